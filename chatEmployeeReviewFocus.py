@@ -1,21 +1,58 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from llama_cpp import Llama
 import os
-import re
+import uuid
+from chatHistory import ChatHistory, system_prompt_with_summary
+from chatStateCache import ChatStateCache
+from chatStreaming import format_timing, stream_text
+from completionCache import CompletionCache, dataset_hash, is_deterministic
+from modelClient import ModelClient
+from reviewEmbeddings import EmbeddingIndex, embed_texts, embedding_path, load_embedding_model, top_k
+from reviewIndex import ReviewIndex, query_keywords
+from reviewStats import answer_data_question
+from sentimentCache import SentimentCache
+from sentimentCheckpoint import SentimentCheckpoint, file_content_hash
+from sentimentEngine import POTENTIAL_TEXT_COLUMNS, classify_texts, find_text_column, format_throughput, model_lock
+from sentimentJobs import SentimentJobManager
+from sentimentWorkers import classify_texts_parallel
 
 # === Configuration ===
 MODEL_PATH = "./Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf"
+MODEL_SERVER_URL = None  # e.g. "http://127.0.0.1:8765" to use a shared modelServer.py instead of loading the model here
 N_CTX = 4096
 N_THREADS = 8
 MAX_TOKENS_RESPONSE = 512
-
-# --- NEW: List of potential column names to look for ---
-POTENTIAL_TEXT_COLUMNS = ["Review", "Employee_Comment", "Comment", "Text", "Feedback"]
+CHAT_TEMPERATURE = 0.7
+CHAT_SAMPLING = {"model": os.path.basename(MODEL_PATH), "temperature": CHAT_TEMPERATURE, "max_tokens": MAX_TOKENS_RESPONSE}
+CHAT_HISTORY_TOKENS = 1024  # Recent chat sent verbatim; older turns are summarized
+CHAT_STATE_CACHE_BYTES = 2 * 1024 ** 3  # Saved per-session KV states, evicted least-recently-used
+SENTIMENT_BATCH_SIZE = 8  # Rows per classification prompt
+SENTIMENT_CACHE_PATH = "./sentiment_cache.sqlite3"  # Labels persist here across uploads and restarts
+SENTIMENT_CHECKPOINT_DIR = "./sentiment_checkpoints"  # Finished rows of interrupted runs, keyed by file hash
+SENTIMENT_WORKERS = 1  # >1 starts that many model processes for classification (memory for throughput)
+SENTIMENT_THREADS_PER_WORKER = N_THREADS
+SENTIMENT_MODE = "generate"  # "logits": one forward pass per row, adds a Confidence column; "grammar": decoding can only emit a label
+SENTIMENT_MAX_CONCURRENT_JOBS = 2  # Uploads labelled at the same time across all sessions
+JOB_POLL_SECONDS = 1.0
+RETRIEVAL_MODE = "bm25"  # "bm25": best-ranked keyword matches; "semantic": most similar by embedding; "sample": random matches
+EMBEDDING_MODEL_PATH = "./bge-small-en-v1.5-q8_0.gguf"  # Only loaded in "semantic" mode
+EMBEDDING_DIR = "./review_embeddings"  # Row embeddings per uploaded file, reused on reload
+EMBEDDING_DTYPE = "int8"  # "float32" keeps full precision at 4x the memory
 
 # === Load LLaMA model with caching ===
 @st.cache_resource(show_spinner="Loading LLaMA model...")
 def load_model():
+    if MODEL_SERVER_URL:
+        # The shared server already holds the model: nothing to load here.
+        client = ModelClient(MODEL_SERVER_URL)
+        try:
+            client.health()
+        except OSError as e:
+            st.error(f"Model server not reachable at {MODEL_SERVER_URL}: {e}")
+            st.stop()
+        return client
     if not os.path.exists(MODEL_PATH):
         st.error(f"Model not found at: {MODEL_PATH}")
         st.stop()
@@ -27,102 +64,175 @@ def load_model():
 
 llm = load_model()
 
-# === Data Processing Function (Cached & Dynamic) ===
-@st.cache_data(show_spinner="Analyzing sentiment in uploaded file...")
-def process_data(uploaded_file):
+# === Per-Session KV State (shared by all sessions) ===
+@st.cache_resource
+def load_chat_state_cache():
+    return ChatStateCache(max_bytes=CHAT_STATE_CACHE_BYTES)
+
+chat_state_cache = load_chat_state_cache()
+
+# === Completion Cache (shared by all sessions) ===
+@st.cache_resource
+def load_completion_cache():
+    return CompletionCache()
+
+completion_cache = load_completion_cache()
+
+@st.cache_resource(show_spinner="Loading embedding model...")
+def load_embedder():
+    if not os.path.exists(EMBEDDING_MODEL_PATH):
+        st.error(f"Embedding model not found at: {EMBEDDING_MODEL_PATH}")
+        st.stop()
+    return load_embedding_model(EMBEDDING_MODEL_PATH, n_threads=N_THREADS)
+
+@st.cache_resource(show_spinner="Loading embeddings...")
+def load_embedding_index(path):
+    return EmbeddingIndex.load(path)
+
+# === Upload Reading (Cached & Dynamic) ===
+@st.cache_data(show_spinner="Reading uploaded file...")
+def read_upload(uploaded_file):
     """
-    Reads an Excel file, dynamically finds the text column, analyzes sentiment, 
+    Reads an Excel file, dynamically finds the text column,
     and returns the DataFrame and the name of the text column found.
     """
     df = pd.read_excel(uploaded_file)
     
     # --- DYNAMIC: Find the first matching text column ---
-    text_column = None
-    for col in POTENTIAL_TEXT_COLUMNS:
-        if col in df.columns:
-            text_column = col
-            break
+    text_column = find_text_column(df.columns)
     
     if text_column is None:
         st.error(f"File must contain one of the following columns: {', '.join(POTENTIAL_TEXT_COLUMNS)}")
         return None, None
+    return df, text_column
 
-    # --- Sentiment Analysis Step ---
-    sentiments = []
-    with st.status(f"Analyzing sentiment in '{text_column}' column...", expanded=True) as status:
-        progress_bar = st.progress(0.0)
-        total_items = len(df[text_column])
+# === Background Sentiment Analysis ===
+@st.cache_resource
+def load_job_manager():
+    """One job pool per server, shared by every session's uploads."""
+    return SentimentJobManager(max_concurrent_jobs=SENTIMENT_MAX_CONCURRENT_JOBS)
 
-        for i, text_content in enumerate(df[text_column]):
-            if pd.isna(text_content):
-                sentiments.append("N/A")
-                continue
-            
-            prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-You are a sentiment analysis expert. Classify the following text as 'Positive', 'Negative', or 'Neutral'. Respond with only one of those three words.<|eot_id|>
-<|start_header_id|>user<|end_header_id|>
-Text: "{text_content}"
-Sentiment:<|eot_id|>
-<|start_header_id|>assistant<|end_header_id|>
-"""
-            
-            output = llm(prompt, max_tokens=8, stop=["\n", "<|eot_id|>"])
-            raw_sentiment = output["choices"][0]["text"].strip().capitalize()
-            
-            if re.search(r'\bPositive\b', raw_sentiment, re.IGNORECASE):
-                sentiments.append("Positive")
-            elif re.search(r'\bNegative\b', raw_sentiment, re.IGNORECASE):
-                sentiments.append("Negative")
-            elif re.search(r'\bNeutral\b', raw_sentiment, re.IGNORECASE):
-                sentiments.append("Neutral")
-            else:
-                sentiments.append("Unrecognized")
-            
-            progress_bar.progress((i + 1) / total_items, text=f"Analyzing item {i+1}/{total_items}")
-        
-        status.update(label="Analysis complete!", state="complete")
+job_manager = load_job_manager()
 
-    df["Sentiment"] = sentiments
-    return df, text_column
+def start_sentiment_job(uploaded_file, df, text_column):
+    """
+    Submits sentiment analysis of the text column as a background job, so the app stays
+    usable while it runs. In "semantic" retrieval mode the job also embeds every row
+    once, saving the matrix for later reloads. Returns the SentimentJob and the
+    embeddings path (None in other modes).
+    """
+    embeddings_path = embedder = None
+    if RETRIEVAL_MODE == "semantic":
+        embedder = load_embedder()
+        embeddings_path = embedding_path(
+            file_content_hash(uploaded_file), text_column, EMBEDDING_MODEL_PATH, EMBEDDING_DTYPE, EMBEDDING_DIR
+        )
+    # If an earlier run on this same file was interrupted, pick up where it stopped.
+    checkpoint = SentimentCheckpoint.for_file(
+        uploaded_file,
+        text_column,
+        directory=SENTIMENT_CHECKPOINT_DIR,
+        model=os.path.basename(MODEL_PATH),
+        mode=SENTIMENT_MODE,
+    )
+    classify_options = dict(
+        subject="Text",
+        batch_size=SENTIMENT_BATCH_SIZE,
+        mode=SENTIMENT_MODE,
+        cache=SentimentCache(SENTIMENT_CACHE_PATH),
+        checkpoint=checkpoint,
+    )
+
+    def classify(texts, progress_callback, labels_callback):
+        if SENTIMENT_WORKERS > 1 and not MODEL_SERVER_URL:
+            # Separate model processes, each with its own threads, sharing the rows.
+            sentiments, stats = classify_texts_parallel(
+                texts,
+                MODEL_PATH,
+                n_workers=SENTIMENT_WORKERS,
+                threads_per_worker=SENTIMENT_THREADS_PER_WORKER,
+                n_ctx=N_CTX,
+                progress_callback=progress_callback,
+                labels_callback=labels_callback,
+                **classify_options,
+            )
+        else:
+            sentiments, stats = classify_texts(
+                llm, texts, progress_callback=progress_callback, labels_callback=labels_callback, **classify_options
+            )
+        checkpoint.finish()
+        if embeddings_path is not None:
+            with model_lock(embedder):
+                EmbeddingIndex.build_or_load(embedder, texts, embeddings_path, EMBEDDING_DTYPE)
+        return sentiments, stats
+
+    return job_manager.submit(uploaded_file.name, df, text_column, classify, key=checkpoint.path), embeddings_path
 
 # === DYNAMIC Context Retrieval Function ===
-def find_relevant_context(query: str, df: pd.DataFrame, text_column: str, max_samples=5) -> str:
+def semantic_search(query: str, df: pd.DataFrame, index: ReviewIndex, embeddings: EmbeddingIndex, sentiment, k):
+    """
+    Positions in df of the k rows whose embeddings are closest to the query's.
+    The embeddings cover every uploaded row, so rows are matched through df's index.
+    """
+    embedder = load_embedder()
+    with model_lock(embedder):
+        query_vector = embed_texts(embedder, [query])[0]
+    if sentiment is None and len(df) == len(embeddings):
+        return embeddings.search(query_vector, k)
+    rows = index.rows_with_sentiment(sentiment) if sentiment else np.arange(len(df))
+    scores = embeddings.scores(query_vector, df.index.to_numpy()[rows])
+    return rows[top_k(scores, k)]
+
+def find_relevant_context(
+    query: str,
+    df: pd.DataFrame,
+    text_column: str,
+    index: ReviewIndex,
+    max_samples=5,
+    mode=RETRIEVAL_MODE,
+    embeddings: EmbeddingIndex = None,
+) -> str:
     """
     Finds relevant text samples from the DataFrame based on keywords in the user's query.
-    This is now fully dynamic and context-agnostic.
+    This is now fully dynamic and context-agnostic. Matching rows come from the
+    prebuilt inverted index, so no per-query scan of the text column is needed.
+    In "bm25" mode the best-scoring matches are sent; in "sample" mode a random sample of them.
+    "semantic" mode ranks by embedding similarity, using BM25 until the embeddings are ready.
     """
     query_lower = query.lower()
     
     # --- Step 1: Filter by sentiment if mentioned ---
     if "negative" in query_lower:
-        search_df = df[df["Sentiment"] == "Negative"]
+        sentiment = "Negative"
     elif "positive" in query_lower:
-        search_df = df[df["Sentiment"] == "Positive"]
+        sentiment = "Positive"
     else:
-        search_df = df
+        sentiment = None
 
-    # --- Step 2: Extract keywords from the query to search for ---
-    # A simple stopword list to make keyword search more relevant
-    stop_words = set(["i", "me", "my", "is", "a", "an", "the", "and", "what", "are", "about", "show", "tell", "of", "in", "on"])
-    query_keywords = [word for word in re.findall(r'\b\w+\b', query_lower) if word not in stop_words and len(word) > 2]
-    
-    if query_keywords:
-        # Search for any of the keywords in the text column
-        keyword_mask = search_df[text_column].str.contains('|'.join(query_keywords), case=False, na=False)
-        relevant_df = search_df[keyword_mask]
+    # --- Step 2: Look up the query's keywords in the index ---
+    keywords = query_keywords(query)
+    if mode == "semantic" and embeddings is not None:
+        ranked = semantic_search(query, df, index, embeddings, sentiment, max_samples)
+    elif mode in ("bm25", "semantic"):
+        ranked = index.search(keywords, max_samples, sentiment)
+    else:
+        ranked = []
+    if len(ranked):
+        sample_df = df.iloc[ranked]
     else:
-        # If no keywords, just use the sentiment-filtered dataframe
-        relevant_df = search_df
+        rows = index.lookup(keywords, sentiment)
 
-    # If filtering results in an empty DataFrame, fall back to a general sample
-    if relevant_df.empty:
-        relevant_df = search_df if not search_df.empty else df
-        
-    num_samples = min(max_samples, len(relevant_df))
-    if num_samples == 0:
-        return "No relevant data found for this query."
-        
-    sample_df = relevant_df.sample(n=num_samples, random_state=42)
+        # If filtering results in no rows, fall back to a general sample
+        if len(rows) == 0:
+            rows = index.lookup([], sentiment)
+            if len(rows) == 0:
+                rows = index.lookup([])
+            
+        num_samples = min(max_samples, len(rows))
+        if num_samples == 0:
+            return "No relevant data found for this query."
+            
+        sample_df = df.iloc[rows].sample(n=num_samples, random_state=42)
 
     context_str = "Here are some relevant data samples:\n\n"
     for _, row in sample_df.iterrows():
@@ -131,7 +241,7 @@ def find_relevant_context(query: str, df: pd.DataFrame, text_column: str, max_sa
     return context_str.strip()
 
 # === DYNAMIC System Prompt Generation ===
-def get_system_prompt(text_column: str, data_summary: str, relevant_context: str) -> str:
+def get_system_prompt(text_column: str, data_summary: str) -> str:
     """Generates a system prompt with a persona adapted to the data context."""
     persona = "a helpful Data Analyst Assistant"
     if text_column == "Employee_Comment":
@@ -140,7 +250,7 @@ def get_system_prompt(text_column: str, data_summary: str, relevant_context: str
         persona = "a helpful Customer Feedback Analyst"
 
     return f"""You are {persona}. Your task is to answer user questions based on the provided data.
-- Base your answers strictly on the 'Relevant Data Samples' and the 'Data Summary'.
+- Base your answers strictly on the 'Relevant Data Samples' sent with each question and the 'Data Summary'.
 - Synthesize information from multiple samples to identify key themes.
 - If the data doesn't contain an answer, state that clearly. Do not invent information.
 
@@ -148,10 +258,17 @@ def get_system_prompt(text_column: str, data_summary: str, relevant_context: str
 DATA SUMMARY:
 {data_summary}
 ---
-RELEVANT DATA SAMPLES:
+"""
+
+def get_question_prompt(question: str, relevant_context: str) -> str:
+    """
+    The user's question with the samples retrieved for it. Kept out of the system
+    prompt so the earlier turns stay a stable prefix whose KV state can be reused.
+    """
+    return f"""RELEVANT DATA SAMPLES:
 {relevant_context}
 ---
-"""
+QUESTION: {question}"""
 
 # === Streamlit App Layout ===
 st.set_page_config(page_title="Contextual Data Chat", layout="wide")
@@ -160,10 +277,73 @@ st.title("📄💬 Chat with your Data")
 # Initialize session state
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "chat_sent" not in st.session_state:
+    # The same turns as the model saw them (questions with their samples, replies
+    # unstripped), so each turn's prompt extends the session's saved KV state.
+    st.session_state.chat_sent = []
+if "chat_session_id" not in st.session_state:
+    st.session_state.chat_session_id = uuid.uuid4().hex
+if "reply_timings" not in st.session_state:
+    st.session_state.reply_timings = []  # Time-to-first-token and tokens/sec of each streamed reply
+if "chat_memory" not in st.session_state:
+    st.session_state.chat_memory = ChatHistory(CHAT_HISTORY_TOKENS)
 if "processed_data" not in st.session_state:
-    st.session_state.processed_data = {"df": None, "text_column": None}
+    st.session_state.processed_data = {"df": None, "text_column": None, "index": None, "version": None}
+if "sentiment_job" not in st.session_state:
+    st.session_state.sentiment_job = {"id": None, "file_id": None, "polling": False, "embeddings_path": None}
 
 # === Sidebar for File Upload and Data Display ===
+job = job_manager.get(st.session_state.sentiment_job["id"])
+
+# Poll only while this session's job is still running.
+@st.fragment(run_every=JOB_POLL_SECONDS if job is not None and job.is_active else None)
+def show_sentiment_job():
+    """Shows job progress and publishes the rows labelled so far to the chat."""
+    job = job_manager.get(st.session_state.sentiment_job["id"])
+    if job is None:
+        return
+
+    labelled_df = job.result_frame()
+    current_df = st.session_state.processed_data["df"]
+    if not labelled_df.empty and (current_df is None or len(current_df) != len(labelled_df)):
+        # New rows were labelled; the keyword index is rebuilt on the next question.
+        st.session_state.processed_data = {
+            "df": labelled_df,
+            "text_column": job.text_column,
+            "index": None,
+            "version": None,
+        }
+
+    if job.is_active:
+        st.progress(job.progress, text=f"Analyzing '{job.text_column}' column: item {job.done}/{job.total}")
+        st.caption("You can already chat about the rows labelled so far.")
+        if st.button("Cancel analysis"):
+            job_manager.cancel(job.id)
+    elif job.status == "done":
+        st.success(f"File processed! Using '{job.text_column}' column. {format_throughput(job.stats)}")
+    else:
+        if job.status == "failed":
+            st.error(f"Analysis failed: {job.error}")
+        else:
+            st.warning("Analysis cancelled. Rows labelled so far are kept.")
+        if st.button("Resume analysis"):
+            job_manager.forget(job.id)
+            st.session_state.sentiment_job = {"id": None, "file_id": None, "polling": False, "embeddings_path": None}
+            st.rerun()
+
+    # Once the job stops, rerun the whole app so polling is switched off.
+    if not job.is_active and st.session_state.sentiment_job["polling"]:
+        st.session_state.sentiment_job["polling"] = False
+        st.rerun()
+
+    processed_df = st.session_state.processed_data["df"]
+    if processed_df is not None:
+        st.subheader("Sentiment Analysis Summary")
+        summary_counts = processed_df["Sentiment"].value_counts()
+        st.bar_chart(summary_counts)
+        st.subheader("Analyzed Data")
+        st.dataframe(processed_df)
+
 with st.sidebar:
     st.header("Upload & Analyze Data")
     uploaded_file = st.file_uploader(
@@ -172,20 +352,31 @@ with st.sidebar:
         key="file_uploader"
     )
 
-    if uploaded_file:
-        df, text_col = process_data(uploaded_file)
+    if uploaded_file and uploaded_file.file_id != st.session_state.sentiment_job["file_id"]:
+        df, text_col = read_upload(uploaded_file)
         if df is not None and text_col is not None:
-            st.session_state.processed_data["df"] = df
-            st.session_state.processed_data["text_column"] = text_col
-            st.success(f"File processed! Using '{text_col}' column.")
+            # The previous upload's job (and its copy of the data) is no longer needed.
+            job_manager.cancel(st.session_state.sentiment_job["id"])
+            job_manager.forget(st.session_state.sentiment_job["id"])
+            job, embeddings_path = start_sentiment_job(uploaded_file, df, text_col)
+            st.session_state.sentiment_job = {
+                "id": job.id,
+                "file_id": uploaded_file.file_id,
+                "polling": True,
+                "embeddings_path": embeddings_path,
+            }
+            st.session_state.processed_data = {"df": None, "text_column": text_col, "index": None, "version": None}
+            st.rerun()
 
-    processed_df = st.session_state.processed_data["df"]
-    if processed_df is not None:
-        st.subheader("Sentiment Analysis Summary")
-        summary_counts = processed_df["Sentiment"].value_counts()
-        st.bar_chart(summary_counts)
-        st.subheader("Analyzed Data")
-        st.dataframe(processed_df)
+    show_sentiment_job()
+
+    st.toggle(
+        "Reuse answers to repeated questions",
+        key="reuse_answers",
+        value=is_deterministic(CHAT_SAMPLING),
+        disabled=is_deterministic(CHAT_SAMPLING),
+        help="Answers the same question on the same data instantly with the earlier reply instead of generating a new one.",
+    )
 
 # === Main Chat Interface ===
 st.subheader("Ask Anything About Your Data")
@@ -196,33 +387,89 @@ for msg in st.session_state.chat_history:
 
 if user_input := st.chat_input("Ask a question about your data..."):
     st.session_state.chat_history.append({"role": "user", "content": user_input})
+    sent_question = user_input
     with st.chat_message("user"):
         st.markdown(user_input)
 
     df = st.session_state.processed_data["df"]
     text_column = st.session_state.processed_data["text_column"]
 
+    sent_reply = None
     if df is None:
         reply = "I'm ready to help, but you need to upload an Excel file first."
+        with st.chat_message("assistant"):
+            st.markdown(reply)
+    elif (reply := answer_data_question(user_input, df, text_column, noun="rows")) is not None:
+        # Counts, percentages and breakdowns come straight from the labels, without the model.
+        with st.chat_message("assistant"):
+            st.markdown(reply)
+            if job is not None and job.is_active:
+                st.caption("Counted from the rows labelled so far; the analysis is still running.")
+            else:
+                st.caption("Counted directly from the labelled data.")
     else:
         with st.spinner("Thinking..."):
-            relevant_context = find_relevant_context(user_input, df, text_column)
+            index = st.session_state.processed_data["index"]
+            if index is None:
+                index = ReviewIndex(df[text_column], df["Sentiment"])
+                st.session_state.processed_data["index"] = index
+            embeddings_path = st.session_state.sentiment_job["embeddings_path"]
+            embeddings = None
+            if embeddings_path is not None and os.path.exists(embeddings_path):
+                embeddings = load_embedding_index(embeddings_path)
+            relevant_context = find_relevant_context(user_input, df, text_column, index, embeddings=embeddings)
             data_summary = df['Sentiment'].value_counts().to_string()
             
-            system_prompt = get_system_prompt(text_column, data_summary, relevant_context)
+            system_prompt = get_system_prompt(text_column, data_summary)
             
-            messages_for_llm = [
-                {"role": "system", "content": system_prompt}
-            ] + st.session_state.chat_history
-
-            output = llm.create_chat_completion(
-                messages=messages_for_llm,
-                max_tokens=MAX_TOKENS_RESPONSE,
-                stop=["<|eot_id|>"],
-                temperature=0.7,
+            # Recent turns within the token budget; older ones only as a rolling summary.
+            sent_question = get_question_prompt(user_input, relevant_context)
+            summary, recent_messages = st.session_state.chat_memory.window(
+                llm, st.session_state.chat_sent + [{"role": "user", "content": sent_question}]
             )
-            reply = output['choices'][0]['message']['content'].strip()
+            messages_for_llm = [
+                {"role": "system", "content": system_prompt_with_summary(system_prompt, summary)}
+            ] + recent_messages
+
+            # Same data, question, context and sampling as an earlier turn: reuse its reply.
+            cache_key = reply = None
+            if st.session_state.reuse_answers:
+                if st.session_state.processed_data["version"] is None:
+                    st.session_state.processed_data["version"] = dataset_hash(df, [text_column, "Sentiment"])
+                cache_key = completion_cache.key(
+                    st.session_state.processed_data["version"],
+                    user_input,
+                    [messages_for_llm[:-1], relevant_context],
+                    CHAT_SAMPLING,
+                )
+                reply = completion_cache.get(cache_key)
+
+        if reply is not None:
+            with st.chat_message("assistant"):
+                st.markdown(reply)
+                st.caption("Reused the answer to an identical earlier question on this data.")
+        else:
+            # Streams the reply as it is generated. Restores this session's KV state, so only the
+            # new turn is evaluated; also waits for a background sentiment job using the model.
+            with st.chat_message("assistant"):
+                timing = {}
+                with chat_state_cache.session(llm, st.session_state.chat_session_id) as model:
+                    stream = model.create_chat_completion(
+                        messages=messages_for_llm,
+                        max_tokens=MAX_TOKENS_RESPONSE,
+                        stop=["<|eot_id|>"],
+                        temperature=CHAT_TEMPERATURE,
+                        stream=True,
+                    )
+                    sent_reply = st.write_stream(stream_text(stream, timing))
+                    reply = sent_reply.strip()
+                st.caption(format_timing(timing))
+            st.session_state.reply_timings.append(timing)
+            if cache_key is not None:
+                completion_cache.put(cache_key, reply)
 
     st.session_state.chat_history.append({"role": "assistant", "content": reply})
-    with st.chat_message("assistant"):
-        st.markdown(reply)
+    st.session_state.chat_sent += [
+        {"role": "user", "content": sent_question},
+        {"role": "assistant", "content": reply if sent_reply is None else sent_reply},
+    ]
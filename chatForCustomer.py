@@ -2,17 +2,52 @@ import streamlit as st
 import pandas as pd
 from llama_cpp import Llama
 import os
-import re
+import uuid
+from chatHistory import ChatHistory, system_prompt_with_summary
+from chatStateCache import ChatStateCache
+from chatStreaming import format_timing, stream_text
+from completionCache import CompletionCache, dataset_hash, is_deterministic
+from modelClient import ModelClient
+from reviewIndex import ReviewIndex, query_keywords
+from reviewStats import answer_data_question
+from sentimentCache import SentimentCache
+from sentimentCheckpoint import SentimentCheckpoint
+from sentimentEngine import classify_texts, format_throughput
+from sentimentJobs import SentimentJobManager
+from sentimentWorkers import classify_texts_parallel
 
 # === Configuration ===
 MODEL_PATH = "./Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf"
+MODEL_SERVER_URL = None  # e.g. "http://127.0.0.1:8765" to use a shared modelServer.py instead of loading the model here
 N_CTX = 4096  # Increased context size for more data
 N_THREADS = 8
 MAX_TOKENS_RESPONSE = 512 # Increased for more detailed answers
+CHAT_TEMPERATURE = 0.7
+CHAT_SAMPLING = {"model": os.path.basename(MODEL_PATH), "temperature": CHAT_TEMPERATURE, "max_tokens": MAX_TOKENS_RESPONSE}
+CHAT_HISTORY_TOKENS = 1024  # Recent chat sent verbatim; older turns are summarized
+CHAT_STATE_CACHE_BYTES = 2 * 1024 ** 3  # Saved per-session KV states, evicted least-recently-used
+SENTIMENT_BATCH_SIZE = 8  # Rows per classification prompt
+SENTIMENT_CACHE_PATH = "./sentiment_cache.sqlite3"  # Labels persist here across uploads and restarts
+SENTIMENT_CHECKPOINT_DIR = "./sentiment_checkpoints"  # Finished rows of interrupted runs, keyed by file hash
+SENTIMENT_WORKERS = 1  # >1 starts that many model processes for classification (memory for throughput)
+SENTIMENT_THREADS_PER_WORKER = N_THREADS
+SENTIMENT_MODE = "generate"  # "logits": one forward pass per row, adds a Confidence column; "grammar": decoding can only emit a label
+SENTIMENT_MAX_CONCURRENT_JOBS = 2  # Uploads labelled at the same time across all sessions
+JOB_POLL_SECONDS = 1.0
+RETRIEVAL_MODE = "bm25"  # "bm25" sends the best-ranked keyword matches; "sample" a random sample by sentiment
 
 # === Load LLaMA model with caching ===
 @st.cache_resource(show_spinner="Loading LLaMA model...")
 def load_model():
+    if MODEL_SERVER_URL:
+        # The shared server already holds the model: nothing to load here.
+        client = ModelClient(MODEL_SERVER_URL)
+        try:
+            client.health()
+        except OSError as e:
+            st.error(f"Model server not reachable at {MODEL_SERVER_URL}: {e}")
+            st.stop()
+        return client
     if not os.path.exists(MODEL_PATH):
         st.error(f"Model not found at: {MODEL_PATH}")
         st.stop()
@@ -26,90 +61,121 @@ def load_model():
 
 llm = load_model()
 
-# === Data Processing Function (Cached) ===
-@st.cache_data(show_spinner="Analyzing sentiment in uploaded file...")
-def process_data(uploaded_file):
+# === Per-Session KV State (shared by all sessions) ===
+@st.cache_resource
+def load_chat_state_cache():
+    return ChatStateCache(max_bytes=CHAT_STATE_CACHE_BYTES)
+
+chat_state_cache = load_chat_state_cache()
+
+# === Completion Cache (shared by all sessions) ===
+@st.cache_resource
+def load_completion_cache():
+    return CompletionCache()
+
+completion_cache = load_completion_cache()
+
+# === Upload Reading (Cached) ===
+@st.cache_data(show_spinner="Reading uploaded file...")
+def read_upload(uploaded_file):
     """
-    Reads an Excel file, analyzes sentiment for each review, and returns a DataFrame.
+    Reads an Excel file and returns it as a DataFrame.
     This function is cached, so it only runs when the uploaded file changes.
     """
     df = pd.read_excel(uploaded_file)
     if "Review" not in df.columns:
         st.error("The uploaded Excel file must contain a column named 'Review'.")
         return None
+    return df
 
-    # --- Sentiment Analysis Step ---
-    sentiments = []
-    
-    # Using st.status for a cleaner progress indicator
-    with st.status("Analyzing sentiments...", expanded=True) as status:
-        progress_bar = st.progress(0.0)
-        total_reviews = len(df['Review'])
-
-        for i, review in enumerate(df["Review"]):
-            if pd.isna(review):
-                sentiments.append("N/A")
-                continue
-            
-            # This is a simple but effective prompt for classification
-            prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-You are a sentiment analysis expert. Classify the following review as 'Positive', 'Negative', or 'Neutral'. Respond with only one of those three words.<|eot_id|>
-<|start_header_id|>user<|end_header_id|>
-Review: "{review}"
-Sentiment:<|eot_id|>
-<|start_header_id|>assistant<|end_header_id|>
-"""
-            
-            output = llm(prompt, max_tokens=8, stop=["\n", "<|eot_id|>"])
-            raw_sentiment = output["choices"][0]["text"].strip().capitalize()
-            
-            # Use regex for more robust matching
-            if re.search(r'\bPositive\b', raw_sentiment, re.IGNORECASE):
-                sentiments.append("Positive")
-            elif re.search(r'\bNegative\b', raw_sentiment, re.IGNORECASE):
-                sentiments.append("Negative")
-            elif re.search(r'\bNeutral\b', raw_sentiment, re.IGNORECASE):
-                sentiments.append("Neutral")
-            else:
-                sentiments.append("Unrecognized")
-            
-            # Update progress
-            progress_bar.progress((i + 1) / total_reviews, text=f"Analyzing review {i+1}/{total_reviews}")
-        
-        status.update(label="Analysis complete!", state="complete")
+# === Background Sentiment Analysis ===
+@st.cache_resource
+def load_job_manager():
+    """One job pool per server, shared by every session's uploads."""
+    return SentimentJobManager(max_concurrent_jobs=SENTIMENT_MAX_CONCURRENT_JOBS)
 
-    df["Sentiment"] = sentiments
-    return df
+job_manager = load_job_manager()
+
+def start_sentiment_job(uploaded_file, df):
+    """
+    Submits sentiment analysis of the reviews as a background job, so the app stays
+    usable while it runs. Returns the SentimentJob.
+    """
+    # If an earlier run on this same file was interrupted, pick up where it stopped.
+    checkpoint = SentimentCheckpoint.for_file(
+        uploaded_file,
+        "Review",
+        directory=SENTIMENT_CHECKPOINT_DIR,
+        model=os.path.basename(MODEL_PATH),
+        mode=SENTIMENT_MODE,
+    )
+    classify_options = dict(
+        subject="Review",
+        batch_size=SENTIMENT_BATCH_SIZE,
+        mode=SENTIMENT_MODE,
+        cache=SentimentCache(SENTIMENT_CACHE_PATH),
+        checkpoint=checkpoint,
+    )
+
+    def classify(texts, progress_callback, labels_callback):
+        if SENTIMENT_WORKERS > 1 and not MODEL_SERVER_URL:
+            # Separate model processes, each with its own threads, sharing the rows.
+            sentiments, stats = classify_texts_parallel(
+                texts,
+                MODEL_PATH,
+                n_workers=SENTIMENT_WORKERS,
+                threads_per_worker=SENTIMENT_THREADS_PER_WORKER,
+                n_ctx=N_CTX,
+                progress_callback=progress_callback,
+                labels_callback=labels_callback,
+                **classify_options,
+            )
+        else:
+            sentiments, stats = classify_texts(
+                llm, texts, progress_callback=progress_callback, labels_callback=labels_callback, **classify_options
+            )
+        checkpoint.finish()
+        return sentiments, stats
+
+    return job_manager.submit(uploaded_file.name, df, "Review", classify, key=checkpoint.path)
 
 # === Context Retrieval Function ===
-def find_relevant_reviews(query: str, df: pd.DataFrame, max_samples=5) -> str:
+def find_relevant_reviews(query: str, df: pd.DataFrame, index: ReviewIndex, max_samples=5, mode=RETRIEVAL_MODE) -> str:
     """
     Finds relevant review samples from the DataFrame based on the user's query.
-    This is the "Retrieval" part of our RAG-lite system.
+    This is the "Retrieval" part of our RAG-lite system. In "bm25" mode the reviews
+    that best match the query's keywords are used, within any sentiment it mentions.
     """
     query = query.lower()
-    relevant_df = pd.DataFrame()
 
     # Simple keyword-based retrieval
     if "negative" in query:
-        relevant_df = df[df["Sentiment"] == "Negative"]
+        sentiment = "Negative"
     elif "positive" in query:
-        relevant_df = df[df["Sentiment"] == "Positive"]
+        sentiment = "Positive"
     elif "neutral" in query:
-        relevant_df = df[df["Sentiment"] == "Neutral"]
-
-    # If specific sentiment is found, sample from it, otherwise sample from all data
-    if not relevant_df.empty:
-        # Take a sample, ensuring we don't exceed the number of available reviews
-        num_samples = min(max_samples, len(relevant_df))
-        sample_df = relevant_df.sample(n=num_samples, random_state=42)
-    elif "review" in query or "customer" in query:
-        # If no specific sentiment but the query seems data-related, provide a general sample
-        num_samples = min(max_samples, len(df))
-        sample_df = df.sample(n=num_samples, random_state=42)
+        sentiment = "Neutral"
+    else:
+        sentiment = None
+
+    ranked = index.search(query_keywords(query), max_samples, sentiment) if mode == "bm25" else []
+    if len(ranked):
+        sample_df = df.iloc[ranked]
     else:
-        # If the query doesn't seem to be about the reviews, don't provide context
-        return "No specific review data seems relevant to this query."
+        relevant_rows = index.rows_with_sentiment(sentiment) if sentiment else []
+
+        # If specific sentiment is found, sample from it, otherwise sample from all data
+        if len(relevant_rows):
+            # Take a sample, ensuring we don't exceed the number of available reviews
+            num_samples = min(max_samples, len(relevant_rows))
+            sample_df = df.iloc[relevant_rows].sample(n=num_samples, random_state=42)
+        elif "review" in query or "customer" in query:
+            # If no specific sentiment but the query seems data-related, provide a general sample
+            num_samples = min(max_samples, len(df))
+            sample_df = df.sample(n=num_samples, random_state=42)
+        else:
+            # If the query doesn't seem to be about the reviews, don't provide context
+            return "No specific review data seems relevant to this query."
 
     # Format the samples into a string for the LLM prompt
     context_str = "Here are some relevant review samples:\n\n"
@@ -125,10 +191,72 @@ st.title("📄💬 Chat with your Review Data (LLaMA 3.1)")
 # Initialize session state
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "chat_sent" not in st.session_state:
+    # The same turns as the model saw them (questions with their samples, replies
+    # unstripped), so each turn's prompt extends the session's saved KV state.
+    st.session_state.chat_sent = []
+if "chat_session_id" not in st.session_state:
+    st.session_state.chat_session_id = uuid.uuid4().hex
+if "reply_timings" not in st.session_state:
+    st.session_state.reply_timings = []  # Time-to-first-token and tokens/sec of each streamed reply
+if "chat_memory" not in st.session_state:
+    st.session_state.chat_memory = ChatHistory(CHAT_HISTORY_TOKENS)
 if "processed_df" not in st.session_state:
     st.session_state.processed_df = None
+    st.session_state.review_index = None
+    st.session_state.dataset_version = None
+if "sentiment_job" not in st.session_state:
+    st.session_state.sentiment_job = {"id": None, "file_id": None, "polling": False}
 
 # === Sidebar for File Upload and Data Display ===
+job = job_manager.get(st.session_state.sentiment_job["id"])
+
+# Poll only while this session's job is still running.
+@st.fragment(run_every=JOB_POLL_SECONDS if job is not None and job.is_active else None)
+def show_sentiment_job():
+    """Shows job progress and publishes the reviews labelled so far to the chat."""
+    job = job_manager.get(st.session_state.sentiment_job["id"])
+    if job is None:
+        return
+
+    labelled_df = job.result_frame()
+    current_df = st.session_state.processed_df
+    if not labelled_df.empty and (current_df is None or len(current_df) != len(labelled_df)):
+        # New reviews were labelled; the keyword index is rebuilt on the next question.
+        st.session_state.processed_df = labelled_df
+        st.session_state.review_index = None
+        st.session_state.dataset_version = None
+
+    if job.is_active:
+        st.progress(job.progress, text=f"Analyzing review {job.done}/{job.total}")
+        st.caption("You can already chat about the reviews labelled so far.")
+        if st.button("Cancel analysis"):
+            job_manager.cancel(job.id)
+    elif job.status == "done":
+        st.success(f"File processed successfully! {format_throughput(job.stats)}")
+    else:
+        if job.status == "failed":
+            st.error(f"Analysis failed: {job.error}")
+        else:
+            st.warning("Analysis cancelled. Reviews labelled so far are kept.")
+        if st.button("Resume analysis"):
+            job_manager.forget(job.id)
+            st.session_state.sentiment_job = {"id": None, "file_id": None, "polling": False}
+            st.rerun()
+
+    # Once the job stops, rerun the whole app so polling is switched off.
+    if not job.is_active and st.session_state.sentiment_job["polling"]:
+        st.session_state.sentiment_job["polling"] = False
+        st.rerun()
+
+    if st.session_state.processed_df is not None:
+        st.subheader("Sentiment Analysis Summary")
+        summary_counts = st.session_state.processed_df["Sentiment"].value_counts()
+        st.bar_chart(summary_counts)
+        
+        st.subheader("Analyzed Data")
+        st.dataframe(st.session_state.processed_df)
+
 with st.sidebar:
     st.header("Upload & Analyze")
     uploaded_file = st.file_uploader(
@@ -137,20 +265,26 @@ with st.sidebar:
         key="file_uploader"
     )
 
-    if uploaded_file:
-        # The magic happens here: process_data is cached
-        df = process_data(uploaded_file)
+    if uploaded_file and uploaded_file.file_id != st.session_state.sentiment_job["file_id"]:
+        df = read_upload(uploaded_file)
         if df is not None:
-            st.session_state.processed_df = df
-            st.success("File processed successfully!")
+            # The previous upload's job (and its copy of the data) is no longer needed.
+            job_manager.cancel(st.session_state.sentiment_job["id"])
+            job_manager.forget(st.session_state.sentiment_job["id"])
+            job = start_sentiment_job(uploaded_file, df)
+            st.session_state.sentiment_job = {"id": job.id, "file_id": uploaded_file.file_id, "polling": True}
+            st.session_state.processed_df = None
+            st.rerun()
 
-    if st.session_state.processed_df is not None:
-        st.subheader("Sentiment Analysis Summary")
-        summary_counts = st.session_state.processed_df["Sentiment"].value_counts()
-        st.bar_chart(summary_counts)
-        
-        st.subheader("Analyzed Data")
-        st.dataframe(st.session_state.processed_df)
+    show_sentiment_job()
+
+    st.toggle(
+        "Reuse answers to repeated questions",
+        key="reuse_answers",
+        value=is_deterministic(CHAT_SAMPLING),
+        disabled=is_deterministic(CHAT_SAMPLING),
+        help="Answers the same question on the same data instantly with the earlier reply instead of generating a new one.",
+    )
 
 # === Main Chat Interface ===
 st.subheader("Ask Anything About the Reviews")
@@ -166,20 +300,33 @@ if user_input := st.chat_input("Ask a question (e.g., 'Show me some negative rev
     st.session_state.chat_history.append({"role": "user", "content": user_input})
     with st.chat_message("user"):
         st.markdown(user_input)
+    sent_question, sent_reply = user_input, None
 
     # Check if a file has been processed
     if st.session_state.processed_df is None:
         reply = "I'm ready to help, but you need to upload an Excel file with reviews first."
+        with st.chat_message("assistant"):
+            st.markdown(reply)
+    elif (reply := answer_data_question(user_input, st.session_state.processed_df, "Review")) is not None:
+        # Counts, percentages and breakdowns come straight from the labels, without the model.
+        with st.chat_message("assistant"):
+            st.markdown(reply)
+            if job is not None and job.is_active:
+                st.caption("Counted from the rows labelled so far; the analysis is still running.")
+            else:
+                st.caption("Counted directly from the labelled data.")
     else:
         # --- RAG in action! ---
         with st.spinner("Thinking..."):
             # 1. Retrieve relevant context
             df = st.session_state.processed_df
-            relevant_context = find_relevant_reviews(user_input, df)
+            if st.session_state.review_index is None:
+                st.session_state.review_index = ReviewIndex(df["Review"], df["Sentiment"])
+            relevant_context = find_relevant_reviews(user_input, df, st.session_state.review_index)
             
             # 2. Augment the prompt
             system_prompt = f"""You are a helpful data analyst assistant. Your task is to answer the user's questions based on the provided review data.
-- First, use the 'Relevant Review Samples' to answer the question directly if possible.
+- First, use the 'Relevant Review Samples' sent with each question to answer it directly if possible.
 - Second, use the 'Data Summary' for broader, quantitative questions.
 - Be concise and base your answers on the data provided.
 - If the data doesn't contain the answer, say so.
@@ -189,32 +336,60 @@ if user_input := st.chat_input("Ask a question (e.g., 'Show me some negative rev
 DATA SUMMARY:
 {df['Sentiment'].value_counts().to_string()}
 ---
-RELEVANT REVIEW SAMPLES:
-{relevant_context}
----
 """
-            # Build conversation history for the model
-            conversation = []
-            for message in st.session_state.chat_history:
-                conversation.append(message)
+            # The samples go with the question rather than the system prompt, so earlier
+            # turns stay a stable prefix whose KV state can be reused.
+            sent_question = f"RELEVANT REVIEW SAMPLES:\n{relevant_context}\n---\nQUESTION: {user_input}"
+            # Build conversation history for the model from the turns as they were sent:
+            # recent turns within the token budget, older ones only as a rolling summary
+            summary, conversation = st.session_state.chat_memory.window(
+                llm, st.session_state.chat_sent + [{"role": "user", "content": sent_question}]
+            )
                 
             # Use the Llama-3 chat template format for best results
             # Note: llama-cpp-python can do this automatically if you set `chat_format`
             # but doing it manually gives you more control.
             messages_for_llm = [
-                {"role": "system", "content": system_prompt}
+                {"role": "system", "content": system_prompt_with_summary(system_prompt, summary)}
             ] + conversation
 
-            # 3. Generate the response
-            output = llm.create_chat_completion(
-                messages=messages_for_llm,
-                max_tokens=MAX_TOKENS_RESPONSE,
-                stop=["<|eot_id|>"],
-                temperature=0.7,
-            )
-            reply = output['choices'][0]['message']['content'].strip()
+            # Same data, question, context and sampling as an earlier turn: reuse its reply.
+            cache_key = reply = None
+            if st.session_state.reuse_answers:
+                if st.session_state.dataset_version is None:
+                    st.session_state.dataset_version = dataset_hash(df, ["Review", "Sentiment"])
+                cache_key = completion_cache.key(
+                    st.session_state.dataset_version, user_input, [messages_for_llm[:-1], relevant_context], CHAT_SAMPLING
+                )
+                reply = completion_cache.get(cache_key)
+
+        if reply is not None:
+            with st.chat_message("assistant"):
+                st.markdown(reply)
+                st.caption("Reused the answer to an identical earlier question on this data.")
+        else:
+            # 3. Stream the response as it is generated, from this session's saved KV state so
+            # only the new turn is evaluated (this also waits for a background sentiment job's current batch)
+            with st.chat_message("assistant"):
+                timing = {}
+                with chat_state_cache.session(llm, st.session_state.chat_session_id) as model:
+                    stream = model.create_chat_completion(
+                        messages=messages_for_llm,
+                        max_tokens=MAX_TOKENS_RESPONSE,
+                        stop=["<|eot_id|>"],
+                        temperature=CHAT_TEMPERATURE,
+                        stream=True,
+                    )
+                    sent_reply = st.write_stream(stream_text(stream, timing))
+                    reply = sent_reply.strip()
+                st.caption(format_timing(timing))
+            st.session_state.reply_timings.append(timing)
+            if cache_key is not None:
+                completion_cache.put(cache_key, reply)
 
-    # Add assistant reply to history and display it
+    # Add assistant reply to history
     st.session_state.chat_history.append({"role": "assistant", "content": reply})
-    with st.chat_message("assistant"):
-        st.markdown(reply)
+    st.session_state.chat_sent += [
+        {"role": "user", "content": sent_question},
+        {"role": "assistant", "content": reply if sent_reply is None else sent_reply},
+    ]
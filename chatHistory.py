@@ -0,0 +1,83 @@
+from sentimentEngine import model_lock
+
+# === Configuration ===
+DEFAULT_HISTORY_TOKENS = 1024  # Recent turns sent verbatim each turn
+MESSAGE_OVERHEAD_TOKENS = 4  # Role header/footer tokens the chat template adds per message
+SUMMARY_MAX_TOKENS = 200
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a data analyst assistant. "
+    "Merge the earlier summary and the new turns into one short summary. Keep the questions asked, "
+    "the facts and numbers given in answers, and any preferences the user stated. Reply with the summary only."
+)
+
+def count_tokens(llm, text):
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+def system_prompt_with_summary(system_prompt, summary):
+    """Appends the rolling summary of older turns, if there is one, to a system prompt."""
+    if not summary:
+        return system_prompt
+    return f"{system_prompt.rstrip()}\n\nEARLIER IN THIS CONVERSATION (summary):\n{summary}\n"
+
+# === History Window ===
+class ChatHistory:
+    """
+    Decides what of a session's chat history is sent to the model each turn: the most
+    recent messages that fit in `budget_tokens`, plus a rolling summary of everything
+    older. Messages that fall out of the window are summarized once, when they leave,
+    so prompt size (and per-turn latency) stays bounded however long the chat gets.
+
+    The window grows until it overflows the budget and is then cut back to the newest
+    `keep_tokens` (half the budget by default) in one go, so the summary call and the
+    change to the system prompt (which invalidates the session's saved KV state) happen
+    once every few turns rather than on every turn.
+    Keep one per session next to the displayed chat history.
+    """
+
+    def __init__(self, budget_tokens=DEFAULT_HISTORY_TOKENS, keep_tokens=None):
+        self.budget_tokens = budget_tokens
+        self.keep_tokens = budget_tokens // 2 if keep_tokens is None else keep_tokens
+        self.summary = ""
+        self.summarized = 0  # Messages at the start of the history folded into the summary
+        self._token_counts = []
+
+    def window(self, llm, messages):
+        """
+        Returns (summary, recent messages) for `messages`, the full history in order.
+        The newest message is always kept, even if it alone exceeds the budget.
+        """
+        for message in messages[len(self._token_counts):]:
+            self._token_counts.append(count_tokens(llm, message["content"]) + MESSAGE_OVERHEAD_TOKENS)
+
+        if sum(self._token_counts[self.summarized:len(messages)]) <= self.budget_tokens:
+            return self.summary, messages[self.summarized:]
+
+        start, used = len(messages), 0
+        while start > self.summarized:
+            used += self._token_counts[start - 1]
+            if used > self.keep_tokens and start < len(messages):
+                break
+            start -= 1
+        # Start the window on a user message so no answer is kept without its question.
+        while start < len(messages) - 1 and messages[start]["role"] != "user":
+            start += 1
+
+        if start > self.summarized:
+            self.summary = self._summarize(llm, messages[self.summarized:start])
+            self.summarized = start
+        return self.summary, messages[start:]
+
+    def _summarize(self, llm, evicted):
+        turns = "\n".join(f"{message['role'].capitalize()}: {message['content']}" for message in evicted)
+        request = f"EARLIER SUMMARY:\n{self.summary or '(none)'}\n\nNEW TURNS:\n{turns}"
+        with model_lock(llm):
+            output = llm.create_chat_completion(
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": request},
+                ],
+                max_tokens=SUMMARY_MAX_TOKENS,
+                temperature=0.0,
+            )
+        return output["choices"][0]["message"]["content"].strip()
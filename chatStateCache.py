@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from sentimentEngine import model_lock
+
+# === Configuration ===
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # Saved KV states kept across all sessions
+
+def state_size(state):
+    """Bytes held by a saved LlamaState: the KV data plus the token and logit arrays."""
+    return state.llama_state_size + state.input_ids.nbytes + state.scores.nbytes
+
+# === Per-Session KV State ===
+class ChatStateCache:
+    """
+    Saved KV state per chat session on a shared Llama. Llama.generate already skips
+    the longest token prefix it has in context, but with several sessions on one model
+    that context is usually someone else's. Restoring the session's own state before
+    its turn means a follow-up only evaluates the tokens after what that session last
+    saw. States are evicted least-recently-used once they exceed `max_bytes` in total.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._states = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, llm, session_id):
+        """
+        Holds the model for one turn of `session_id`: its KV state is loaded on entry
+        and saved again on exit. Use around the completion call, on the model it yields.
+        A modelClient.ModelClient keeps the session's state on the server instead.
+        """
+        if getattr(llm, "is_remote", False):
+            with llm.session(session_id) as client:
+                yield client
+            return
+        with model_lock(llm):
+            self._restore(llm, session_id)
+            try:
+                yield llm
+            finally:
+                self._save(llm, session_id)
+
+    def _restore(self, llm, session_id):
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is not None:
+                self._states.move_to_end(session_id)
+        if state is None:
+            return
+        n_tokens = state.n_tokens
+        if llm.n_tokens >= n_tokens and list(llm.input_ids[:n_tokens]) == list(state.input_ids[:n_tokens]):
+            return  # Nothing else has used the model since this session's last turn.
+        llm.load_state(state)
+
+    def _save(self, llm, session_id):
+        state = llm.save_state()
+        # Only the last row of logits is ever read, since generate re-evaluates at least
+        # one token; load_state broadcasts this row back over the rest.
+        state.scores = state.scores[-1:].copy()
+        size = state_size(state)
+        with self._lock:
+            self._discard(session_id)
+            if size > self.max_bytes:
+                return
+            self._states[session_id] = state
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._discard(next(iter(self._states)))
+
+    def _discard(self, session_id):
+        state = self._states.pop(session_id, None)
+        if state is not None:
+            self._bytes -= state_size(state)
+
+    def forget(self, session_id):
+        """Drops a session's saved state, e.g. when its chat is cleared."""
+        with self._lock:
+            self._discard(session_id)
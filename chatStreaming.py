@@ -0,0 +1,35 @@
+import time
+
+def stream_text(chunks, timing):
+    """
+    Yields the text of each chunk of a streamed completion (create_chat_completion or
+    a plain completion called with stream=True), for st.write_stream. Fills `timing`
+    with time-to-first-token, the token count and generation speed as it goes.
+    The prompt is evaluated on the first chunk, so call this inside the model lock.
+    """
+    start = time.perf_counter()
+    tokens = 0
+    for chunk in chunks:
+        choice = chunk["choices"][0]
+        text = choice["delta"].get("content") if "delta" in choice else choice.get("text")
+        if not text:
+            continue  # e.g. the role-only first delta of a chat stream
+        tokens += 1
+        if tokens == 1:
+            timing["ttft"] = time.perf_counter() - start
+        yield text
+
+    elapsed = time.perf_counter() - start
+    timing.setdefault("ttft", elapsed)
+    timing["tokens"] = tokens
+    timing["seconds"] = elapsed
+    generating = elapsed - timing["ttft"]
+    # Tokens after the first, over the time spent producing them.
+    timing["tokens_per_sec"] = (tokens - 1) / generating if tokens > 1 and generating > 0 else 0.0
+
+def format_timing(timing):
+    """One-line summary of a streamed reply's timing, for st.caption."""
+    return (
+        f"First token in {timing['ttft']:.2f} s · {timing['tokens']} tokens "
+        f"at {timing['tokens_per_sec']:.1f} tokens/s"
+    )
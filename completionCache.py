@@ -0,0 +1,69 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+# === Configuration ===
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+
+def normalize_question(question):
+    """Case, whitespace and trailing punctuation do not change the question."""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+def content_hash(value):
+    """SHA-256 of any JSON-serializable value (prompts, message lists, parameters)."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def dataset_hash(df, columns):
+    """Fingerprint of a labelled DataFrame's relevant columns, hashed row-wise by pandas."""
+    row_hashes = pd.util.hash_pandas_object(df[columns], index=True).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+def is_deterministic(sampling):
+    """Whether these sampling parameters always produce the same completion for a prompt."""
+    return sampling.get("temperature", 0.8) == 0 or sampling.get("top_k") == 1
+
+# === Completion Cache ===
+class CompletionCache:
+    """
+    Replies to chat questions, shared by every session on the server, keyed by the
+    dataset version, the normalized question, a hash of everything else in the prompt
+    (retrieved samples, system prompt, earlier turns) and the sampling parameters.
+    Entries expire after `ttl_seconds`; beyond `max_entries` the least recently used go.
+    Only use it for deterministic sampling, or when the user has opted in to reusing
+    sampled replies.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(dataset_version, question, context, sampling):
+        return (dataset_version, normalize_question(question), content_hash(context), content_hash(sampling))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            reply, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return reply
+
+    def put(self, key, reply):
+        with self._lock:
+            self._entries[key] = (reply, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -2,16 +2,38 @@ import streamlit as st
 import pandas as pd
 from llama_cpp import Llama
 import os
+import uuid
+from chatHistory import ChatHistory, system_prompt_with_summary
+from chatStateCache import ChatStateCache
+from chatStreaming import format_timing, stream_text
+from completionCache import CompletionCache, dataset_hash, is_deterministic
+from modelClient import ModelClient
+from reviewStats import answer_data_question
+from sentimentEngine import classify_texts, PLAIN_SENTIMENT_PROMPT
 
 # === Configuration ===
 MODEL_PATH = "./Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf"
+MODEL_SERVER_URL = None  # e.g. "http://127.0.0.1:8765" to use a shared modelServer.py instead of loading the model here
 N_CTX = 2048
 N_THREADS = 8
 MAX_TOKENS = 256
+CHAT_TEMPERATURE = 0.8
+CHAT_SAMPLING = {"model": os.path.basename(MODEL_PATH), "temperature": CHAT_TEMPERATURE, "max_tokens": MAX_TOKENS}
+CHAT_HISTORY_TOKENS = 768  # Recent chat sent verbatim; older turns are summarized
+CHAT_STATE_CACHE_BYTES = 2 * 1024 ** 3  # Saved per-session KV states, evicted least-recently-used
 
 # === Load LLaMA model with caching ===
 @st.cache_resource(show_spinner="Loading LLaMA model...")
 def load_model():
+    if MODEL_SERVER_URL:
+        # The shared server already holds the model: nothing to load here.
+        client = ModelClient(MODEL_SERVER_URL)
+        try:
+            client.health()
+        except OSError as e:
+            st.error(f"Model server not reachable at {MODEL_SERVER_URL}: {e}")
+            st.stop()
+        return client
     if not os.path.exists(MODEL_PATH):
         raise FileNotFoundError(f"Model not found at: {MODEL_PATH}")
     return Llama(
@@ -22,6 +44,20 @@ def load_model():
 
 llm = load_model()
 
+# === Per-Session KV State (shared by all sessions) ===
+@st.cache_resource
+def load_chat_state_cache():
+    return ChatStateCache(max_bytes=CHAT_STATE_CACHE_BYTES)
+
+chat_state_cache = load_chat_state_cache()
+
+# === Completion Cache (shared by all sessions) ===
+@st.cache_resource
+def load_completion_cache():
+    return CompletionCache()
+
+completion_cache = load_completion_cache()
+
 # === Streamlit App Layout ===
 st.set_page_config(page_title="Sentiment Chat Assistant", layout="wide")
 st.title("💬 Sentiment Chat Assistant with Memory (LLaMA 3.1)")
@@ -32,6 +68,12 @@ uploaded_file = st.file_uploader("Upload an Excel file with a 'Review' column",
 # === Session State for Memory ===
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "chat_session_id" not in st.session_state:
+    st.session_state.chat_session_id = uuid.uuid4().hex
+if "reply_timings" not in st.session_state:
+    st.session_state.reply_timings = []  # Time-to-first-token and tokens/sec of each streamed reply
+if "chat_memory" not in st.session_state:
+    st.session_state.chat_memory = ChatHistory(CHAT_HISTORY_TOKENS)
 if "df" not in st.session_state:
     st.session_state.df = None
 if "sentiment_summary" not in st.session_state:
@@ -49,27 +91,13 @@ if uploaded_file:
 
         if "Sentiment" not in df.columns:
             with st.spinner("Analyzing sentiments..."):
-                def generate_sentiment_prompt(review):
-                    return f"""You are a sentiment classifier.
-Classify this review as Positive, Neutral, or Negative.
-Review: "{review}"
-Sentiment (only one word):"""
-
-                def analyze_sentiment(review):
-                    prompt = generate_sentiment_prompt(str(review))
-                    output = llm(prompt, max_tokens=10, stop=["\n"])
-                    raw = output["choices"][0]["text"].strip().capitalize()
-                    if raw.startswith("Positive"):
-                        return "Positive"
-                    elif raw.startswith("Negative"):
-                        return "Negative"
-                    elif raw.startswith("Neutral"):
-                        return "Neutral"
-                    return "Unrecognized"
-
-                df["Sentiment"] = df["Review"].apply(
-                    lambda r: analyze_sentiment(r) if pd.notna(r) else "N/A"
+                # Row by row with the plain prompt; its instruction prefix is evaluated once
+                # and reused from the KV cache for every review. The label grammar limits each
+                # reply to one of the labels, so no row comes back 'Unrecognized'.
+                sentiments, _ = classify_texts(
+                    llm, df["Review"], subject="Review", batch_size=1, prompt=PLAIN_SENTIMENT_PROMPT, mode="grammar"
                 )
+                df["Sentiment"] = sentiments
                 st.session_state.df = df
 
         summary_counts = st.session_state.df["Sentiment"].value_counts().to_dict()
@@ -85,6 +113,20 @@ Sentiment (only one word):"""
 # === Chat Interface ===
 st.markdown("---")
 st.subheader("💬 Ask Anything About the Reviews")
+st.toggle(
+    "Reuse answers to repeated questions",
+    key="reuse_answers",
+    value=is_deterministic(CHAT_SAMPLING),
+    disabled=is_deterministic(CHAT_SAMPLING),
+    help="Answers the same question on the same data instantly with the earlier reply instead of generating a new one.",
+)
+
+# Display chat history
+for msg in st.session_state.chat_history:
+    if msg["role"] == "user":
+        st.chat_message("user").write(msg["content"])
+    else:
+        st.chat_message("assistant").write(msg["content"])
 
 # Chat input box
 user_input = st.chat_input("Ask a question about the data (e.g., 'How many negative reviews?')")
@@ -92,6 +134,7 @@ user_input = st.chat_input("Ask a question about the data (e.g., 'How many negat
 if user_input:
     # Append user message to history
     st.session_state.chat_history.append({"role": "user", "content": user_input})
+    st.chat_message("user").write(user_input)
 
     # Detect if user input is review-related
     file_keywords = [
@@ -103,6 +146,15 @@ if user_input:
     # If asking about file but no file is uploaded
     if is_file_related and (st.session_state.df is None or st.session_state.sentiment_summary == ""):
         reply = "⚠️ There's no file to analyze. Please upload an Excel file with reviews."
+        st.chat_message("assistant").write(reply)
+    elif (
+        st.session_state.df is not None
+        and (reply := answer_data_question(user_input, st.session_state.df, "Review")) is not None
+    ):
+        # Counts, percentages and breakdowns come straight from the labels, without the model.
+        with st.chat_message("assistant"):
+            st.write(reply)
+            st.caption("Counted directly from the labelled data.")
     else:
         # === Full context + chat memory ===
         system_context = f"""You are an intelligent assistant. When a user uploads a file of customer reviews,
@@ -116,25 +168,50 @@ Otherwise, respond as a general assistant.
 """
 
         # Build conversation history prompt
-        conversation = f"{system_context}\n\n"
-        for message in st.session_state.chat_history:
+        # Recent turns within the token budget; older ones only as a rolling summary
+        summary, recent_messages = st.session_state.chat_memory.window(llm, st.session_state.chat_history)
+        conversation = f"{system_prompt_with_summary(system_context, summary)}\n\n"
+        for message in recent_messages:
             if message["role"] == "user":
                 conversation += f"User: {message['content']}\n"
             else:
                 conversation += f"Assistant: {message['content']}\n"
         conversation += "Assistant:"
 
-        # Generate response from model
-        with st.spinner("Generating response..."):
-            output = llm(conversation, max_tokens=MAX_TOKENS, stop=["\nUser:", "\nAssistant:"])
-            reply = output["choices"][0]["text"].strip()
+        # Same data, question, prompt and sampling as an earlier turn: reuse its reply.
+        cache_key = reply = None
+        if st.session_state.reuse_answers:
+            df = st.session_state.df
+            cache_key = completion_cache.key(
+                None if df is None else dataset_hash(df, ["Review", "Sentiment"]),
+                user_input,
+                [system_prompt_with_summary(system_context, summary), recent_messages[:-1]],
+                CHAT_SAMPLING,
+            )
+            reply = completion_cache.get(cache_key)
+
+        if reply is not None:
+            with st.chat_message("assistant"):
+                st.write(reply)
+                st.caption("Reused the answer to an identical earlier question on this data.")
+        else:
+            # Stream the response as it is generated, from this session's saved KV state so
+            # only the new turn is evaluated
+            with st.chat_message("assistant"):
+                timing = {}
+                with chat_state_cache.session(llm, st.session_state.chat_session_id) as model:
+                    stream = model(
+                        conversation,
+                        max_tokens=MAX_TOKENS,
+                        temperature=CHAT_TEMPERATURE,
+                        stop=["\nUser:", "\nAssistant:"],
+                        stream=True,
+                    )
+                    reply = st.write_stream(stream_text(stream, timing)).strip()
+                st.caption(format_timing(timing))
+            st.session_state.reply_timings.append(timing)
+            if cache_key is not None:
+                completion_cache.put(cache_key, reply)
 
     # Append model reply
     st.session_state.chat_history.append({"role": "assistant", "content": reply})
-
-# Display chat history
-for msg in st.session_state.chat_history:
-    if msg["role"] == "user":
-        st.chat_message("user").write(msg["content"])
-    else:
-        st.chat_message("assistant").write(msg["content"])
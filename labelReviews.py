@@ -0,0 +1,194 @@
+"""
+Headless sentiment labelling for Excel/CSV/Parquet exports, e.g. as a nightly job.
+
+    python labelReviews.py reviews.xlsx --column Review --output labelled.xlsx --batch-size 8 --workers 4
+
+Uses the same prompts, label parsing and on-disk cache as the Streamlit apps,
+without importing streamlit. The input is streamed in chunks and labelled chunks
+are written out as they finish, so memory is bounded by --chunk-size.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+import pandas as pd
+
+from modelClient import ModelClient
+from reviewEmbeddings import EMBEDDING_DTYPES, EMBEDDING_MODEL_PATH, EmbeddingIndex, embed_texts, load_embedding_model
+from reviewReader import DEFAULT_CHUNK_SIZE, ChunkWriter, iter_row_chunks
+from sentimentCache import DEFAULT_CACHE_PATH, SentimentCache
+from sentimentCheckpoint import DEFAULT_CHECKPOINT_DIR, SentimentCheckpoint
+from sentimentEngine import (
+    CLASSIFICATION_MODES,
+    DEFAULT_BATCH_SIZE,
+    LLAMA3_REASON_SENTIMENT_PROMPT,
+    LLAMA3_SENTIMENT_PROMPT,
+    POTENTIAL_TEXT_COLUMNS,
+    classify_texts,
+    find_text_column,
+    format_throughput,
+)
+from sentimentWorkers import DEFAULT_THREADS_PER_WORKER, SentimentWorkerPool
+
+# === Configuration ===
+MODEL_PATH = "./Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf"
+N_CTX = 4096
+
+# === Labelling ===
+def open_classifier(args, stack, checkpoint=None):
+    """
+    Loads the model (or starts the worker pool, or connects to a model server) once and
+    returns classify(texts, subject, progress_callback) -> (labels, stats).
+    """
+    options = dict(
+        batch_size=args.batch_size,
+        mode=args.mode,
+        prompt=LLAMA3_REASON_SENTIMENT_PROMPT if args.reasons else LLAMA3_SENTIMENT_PROMPT,
+        cache=None if args.no_cache else SentimentCache(args.cache),
+        checkpoint=checkpoint,
+    )
+    if args.server:
+        client = ModelClient(args.server)
+        client.health()
+        return lambda texts, subject, progress_callback: classify_texts(
+            client, texts, subject=subject, progress_callback=progress_callback, **options
+        )
+    if args.workers > 1:
+        pool = stack.enter_context(
+            SentimentWorkerPool(args.model, args.workers, args.threads_per_worker, N_CTX)
+        )
+        return lambda texts, subject, progress_callback: pool.classify(
+            texts, subject=subject, progress_callback=progress_callback, **options
+        )
+
+    from llama_cpp import Llama
+
+    llm = Llama(model_path=args.model, n_ctx=N_CTX, n_threads=args.threads_per_worker, verbose=False)
+    return lambda texts, subject, progress_callback: classify_texts(
+        llm, texts, subject=subject, progress_callback=progress_callback, **options
+    )
+
+def label_file(args, output):
+    """
+    Streams args.input through the classifier into `output`. Returns (stats, label counts).
+    Finished rows are checkpointed, so rerunning after a crash only labels the rest.
+    """
+    chunks = iter_row_chunks(args.input, args.chunk_size)
+    first = next(chunks, None)
+    if first is None:
+        sys.exit(f"No rows found in {args.input}")
+    text_column = args.column or find_text_column(first.columns)
+    if text_column not in first.columns:
+        sys.exit(f"File must contain one of the following columns: {', '.join(POTENTIAL_TEXT_COLUMNS)}")
+    subject = "Review" if text_column == "Review" else "Text"
+    checkpoint = None
+    if not args.no_checkpoint:
+        checkpoint = SentimentCheckpoint.for_file(
+            args.input,
+            text_column,
+            directory=args.checkpoint_dir,
+            model=os.path.basename(args.model),
+            mode=args.mode,
+        )
+
+    totals = {"rows": 0, "classified": 0, "resumed": 0, "cache_hits": 0}
+    label_counts = Counter()
+    embedder = load_embedding_model(args.embedding_model, args.threads_per_worker) if args.embeddings else None
+    embedding_parts = []
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        classify = open_classifier(args, stack, checkpoint)
+        writer = stack.enter_context(ChunkWriter(output))
+        for chunk in itertools.chain([first], chunks):
+            rows_before = totals["rows"]
+
+            def print_progress(done, total):
+                print(f"\rLabelled {rows_before + done} rows", end="", file=sys.stderr, flush=True)
+
+            labels, stats = classify(chunk[text_column], subject, print_progress)
+            chunk["Sentiment"] = labels
+            if "confidences" in stats:
+                chunk["Confidence"] = pd.Series(stats["confidences"], index=chunk.index, dtype="float64")
+            if "reasons" in stats:
+                chunk["Reason"] = stats["reasons"]
+            writer.write(chunk)
+            if embedder is not None:
+                # Quantized per chunk (scales are per row), so only the stored dtype is kept.
+                embedding_parts.append(EmbeddingIndex(embed_texts(embedder, chunk[text_column]), args.embedding_dtype))
+
+            for key in totals:
+                totals[key] += stats[key]
+            label_counts.update(labels)
+    print(file=sys.stderr)
+    if checkpoint is not None:
+        checkpoint.finish()
+    if embedder is not None:
+        # Saved next to the labelled output for semantic search over it.
+        EmbeddingIndex.concatenate(embedding_parts).save(embeddings_output(output))
+
+    elapsed = time.perf_counter() - start
+    totals["seconds"] = elapsed
+    totals["rows_per_sec"] = totals["rows"] / elapsed if elapsed > 0 else float("inf")
+    return totals, label_counts
+
+def embeddings_output(output):
+    return f"{os.path.splitext(output)[0]}.embeddings.npz"
+
+# === CLI ===
+def build_parser():
+    parser = argparse.ArgumentParser(description="Label the sentiment of every row in an Excel/CSV/Parquet file.")
+    parser.add_argument("input", help="Input .xlsx/.xls/.csv/.parquet file")
+    parser.add_argument(
+        "--column",
+        help=f"Text column to classify (default: first of {', '.join(POTENTIAL_TEXT_COLUMNS)})",
+    )
+    parser.add_argument("--output", help="Output .xlsx/.csv/.parquet file (default: <input>_labelled.<ext>)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per classification prompt")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows read and written at a time")
+    parser.add_argument("--workers", type=int, default=1, help="Model processes to run in parallel")
+    parser.add_argument(
+        "--threads-per-worker", type=int, default=DEFAULT_THREADS_PER_WORKER, help="llama.cpp threads per model"
+    )
+    parser.add_argument("--mode", choices=CLASSIFICATION_MODES, default="generate", help="Classification mode")
+    parser.add_argument(
+        "--reasons", action="store_true", help="Add a short Reason column (needs --mode grammar, labels row by row)"
+    )
+    parser.add_argument("--model", default=MODEL_PATH, help="Path to the GGUF model")
+    parser.add_argument("--server", help="URL of a running modelServer.py to classify with instead of --model")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="SQLite sentiment cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the sentiment cache")
+    parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR, help="Where interrupted jobs keep finished rows")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not resume from or write job checkpoints")
+    parser.add_argument("--embeddings", action="store_true", help="Also save row embeddings next to the output")
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL_PATH, help="Path to the GGUF embedding model")
+    parser.add_argument("--embedding-dtype", choices=EMBEDDING_DTYPES, default="int8", help="Stored embedding precision")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.reasons and args.mode != "grammar":
+        parser.error("--reasons needs --mode grammar")
+    if not args.server and not os.path.exists(args.model):
+        sys.exit(f"Model not found at: {args.model}")
+
+    output = args.output
+    if output is None:
+        root, ext = os.path.splitext(args.input)
+        output = f"{root}_labelled{'.xlsx' if ext.lower() == '.xls' else ext}"
+
+    stats, label_counts = label_file(args, output)
+
+    print(f"Labelled {format_throughput(stats)}")
+    for label, count in label_counts.most_common():
+        print(f"{label}: {count}")
+    print(f"Saved labelled data to {output}")
+    if args.embeddings:
+        print(f"Saved embeddings to {embeddings_output(output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import json
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+from sentimentEngine import DEFAULT_BATCH_SIZE, LLAMA3_SENTIMENT_PROMPT, label_distinct_texts
+
+# === Configuration ===
+DEFAULT_SERVER_URL = "http://127.0.0.1:8765"
+DEFAULT_TIMEOUT = 600  # Seconds; long classification streams send an update after every step
+
+class ModelServerError(RuntimeError):
+    """The model server answered with an error."""
+
+# === Thin Client ===
+class ModelClient:
+    """
+    Stands in for a Llama in the apps when a modelServer.py process holds the model.
+    Provides the parts of the Llama API they use (tokenize, create_completion /
+    __call__, create_chat_completion, with stream=True) plus classify(), which
+    sentimentEngine.classify_texts hands off to when given a client.
+    """
+
+    is_remote = True
+
+    def __init__(self, url=DEFAULT_SERVER_URL, session_id=None, timeout=DEFAULT_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.session_id = session_id
+        self.timeout = timeout
+
+    def _open(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.url}{path}", data=data, headers={"Content-Type": "application/json"}
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            raise ModelServerError(json.loads(e.read() or b"{}").get("error", str(e))) from None
+
+    def _post(self, path, payload):
+        with self._open(path, payload) as response:
+            return json.load(response)
+
+    def _stream(self, path, payload):
+        with self._open(path, payload) as response:
+            for line in response:
+                event = json.loads(line)
+                if "error" in event:
+                    raise ModelServerError(event["error"])
+                yield event
+
+    def health(self):
+        """Raises OSError if the server cannot be reached; returns its model name."""
+        with self._open("/health") as response:
+            return json.load(response)["model"]
+
+    # --- Llama API ---
+    def tokenize(self, text, add_bos=True, special=False):
+        return self._post("/tokenize", {"text": text.decode("utf-8"), "add_bos": add_bos, "special": special})["tokens"]
+
+    def _complete(self, path, payload, stream, kwargs):
+        payload = dict(kwargs, **payload)
+        if self.session_id:
+            payload["session_id"] = self.session_id
+        if stream:
+            payload["stream"] = True
+            return self._stream(path, payload)
+        return self._post(path, payload)
+
+    def create_completion(self, prompt, stream=False, **kwargs):
+        return self._complete("/v1/completions", {"prompt": prompt}, stream, kwargs)
+
+    __call__ = create_completion
+
+    def create_chat_completion(self, messages, stream=False, **kwargs):
+        return self._complete("/v1/chat/completions", {"messages": messages}, stream, kwargs)
+
+    @contextmanager
+    def session(self, session_id):
+        """A client whose completions reuse `session_id`'s KV state on the server."""
+        yield ModelClient(self.url, session_id, self.timeout)
+
+    # --- Classification ---
+    def classify(
+        self,
+        texts,
+        subject="Text",
+        batch_size=DEFAULT_BATCH_SIZE,
+        progress_callback=None,
+        prompt=LLAMA3_SENTIMENT_PROMPT,
+        mode="generate",
+        cache=None,
+        deduplicate=True,
+        checkpoint=None,
+        labels_callback=None,
+    ):
+        """
+        Same contract as sentimentEngine.classify_texts. Deduplication and the checkpoint
+        are handled here; the server classifies the distinct texts, merged with other
+        clients' requests, and uses its own sentiment cache (`cache` is ignored).
+        """
+
+        def label_on_server(pending_texts, counts):
+            if not pending_texts:
+                return
+            payload = {
+                "texts": pending_texts,
+                "subject": subject,
+                "batch_size": batch_size,
+                "prompt": prompt,
+                "mode": mode,
+            }
+            for event in self._stream("/classify", payload):
+                if "stats" in event:
+                    counts.update(event["stats"])
+                    continue
+                yield event["positions"], event["labels"], event["confidences"], [None] * len(event["positions"])
+
+        return label_distinct_texts(
+            texts,
+            label_on_server,
+            mode=mode,
+            deduplicate=deduplicate,
+            checkpoint=checkpoint,
+            progress_callback=progress_callback,
+            labels_callback=labels_callback,
+        )
@@ -0,0 +1,335 @@
+"""
+Shared model server: loads the GGUF once and serves every app on this host over
+local HTTP, so running several apps costs one model's RAM and they start instantly.
+
+    python modelServer.py --model ./Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf --port 8765
+
+Point an app at it with MODEL_SERVER_URL = "http://127.0.0.1:8765"; the app then
+talks to it through modelClient.ModelClient instead of loading its own Llama.
+Requests queue on the model; sentiment classification requests from all clients
+are merged into shared batches (see ClassifyBatcher).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+
+from chatStateCache import ChatStateCache
+from sentimentCache import DEFAULT_CACHE_PATH, SentimentCache, model_name, prompt_version, text_hash
+from sentimentEngine import (
+    LLAMA3_SENTIMENT_PROMPT,
+    UNRECOGNIZED_LABEL,
+    classify_texts,
+    group_duplicates,
+    model_lock,
+)
+
+# === Configuration ===
+MODEL_PATH = "./Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf"
+DEFAULT_HOST = "127.0.0.1"  # Local only; there is no authentication
+DEFAULT_PORT = 8765
+N_CTX = 4096
+N_THREADS = 8
+CLASSIFY_STEP_ROWS = 64  # Queued texts, across all requests, classified per step
+CLASSIFY_OPTIONS = ["subject", "batch_size", "prompt", "mode"]
+
+# === Classification Batching ===
+class ClassifyRequest:
+    """One client's texts; labels go back through `events` as steps finish."""
+
+    def __init__(self, texts, options):
+        self.texts = texts
+        self.options = options
+        self.key = json.dumps(options, sort_keys=True)
+        self.members = group_duplicates(texts)
+        self.pending = deque(self.members)
+        self.done = len(texts) - sum(len(rows) for rows in self.members.values())
+        self.classified = 0
+        self.cache_hits = 0
+        self.cancelled = False
+        self.events = Queue()
+
+    def deliver(self, indices, labels, confidences):
+        rows, row_labels, row_confidences = [], [], []
+        for i, label, confidence in zip(indices, labels, confidences):
+            for row in self.members[i]:
+                rows.append(row)
+                row_labels.append(label)
+                row_confidences.append(confidence)
+        self.done += len(rows)
+        self.events.put({"positions": rows, "labels": row_labels, "confidences": row_confidences, "done": self.done})
+
+    def finish(self):
+        self.events.put({"stats": {"classified": self.classified, "cache_hits": self.cache_hits}})
+
+    def fail(self, message):
+        self.events.put({"error": message})
+
+class ClassifyBatcher:
+    """
+    Runs classification requests from all clients through the model together. Each
+    step takes up to `step_rows` queued texts, oldest request first, from every
+    request with the same options, so batch prompts stay full and a new request joins
+    at the next step instead of waiting for earlier ones to finish. llama.cpp has no
+    multi-sequence API here, so this batches at the prompt level between steps rather
+    than per token.
+    """
+
+    def __init__(self, llm, cache=None, step_rows=CLASSIFY_STEP_ROWS):
+        self.llm = llm
+        self.cache = cache
+        self.step_rows = step_rows
+        self._requests = deque()
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, name="classify-batcher", daemon=True).start()
+
+    def _cache_key(self, request):
+        return model_name(self.llm), prompt_version(
+            request.options.get("prompt", LLAMA3_SENTIMENT_PROMPT),
+            request.options.get("subject", "Text"),
+            request.options.get("mode", "generate"),
+        )
+
+    def submit(self, texts, options):
+        request = ClassifyRequest(texts, options)
+        if self.cache is not None and request.pending:
+            hashes = {i: text_hash(texts[i]) for i in request.pending}
+            cached = self.cache.get_many(*self._cache_key(request), set(hashes.values()))
+            hits = [i for i in request.pending if hashes[i] in cached]
+            if hits:
+                request.pending = deque(i for i in request.pending if hashes[i] not in cached)
+                request.cache_hits = sum(len(request.members[i]) for i in hits)
+                request.deliver(hits, *zip(*(cached[hashes[i]] for i in hits)))
+        if request.pending:
+            with self._condition:
+                self._requests.append(request)
+                self._condition.notify()
+        else:
+            request.finish()
+        return request
+
+    def cancel(self, request):
+        """Stops classifying a request whose client went away; it is dropped at the next step."""
+        with self._condition:
+            request.cancelled = True
+
+    def _next_step(self):
+        with self._condition:
+            while True:
+                for request in [request for request in self._requests if request.cancelled]:
+                    self._requests.remove(request)
+                if self._requests:
+                    break
+                self._condition.wait()
+            key = self._requests[0].key
+            step = []
+            for request in self._requests:
+                if request.key != key:
+                    continue
+                while request.pending and len(step) < self.step_rows:
+                    step.append((request, request.pending.popleft()))
+                if len(step) == self.step_rows:
+                    break
+            return step
+
+    def _run(self):
+        while True:
+            step = self._next_step()
+            requests = list(dict.fromkeys(request for request, _ in step))
+            try:
+                labels, stats = classify_texts(
+                    self.llm, [request.texts[i] for request, i in step], **requests[0].options
+                )
+            except Exception as e:
+                with self._condition:
+                    for request in requests:
+                        self._requests.remove(request)
+                        request.fail(str(e))
+                continue
+
+            confidences = stats.get("confidences", [None] * len(step))
+            for request in requests:
+                mine = [position for position, (owner, _) in enumerate(step) if owner is request]
+                request.classified += len(mine)
+                request.deliver(
+                    [step[position][1] for position in mine],
+                    [labels[position] for position in mine],
+                    [confidences[position] for position in mine],
+                )
+                if self.cache is not None:
+                    # 'Unrecognized' is left uncached so those rows get another try next run.
+                    self.cache.put_many(
+                        *self._cache_key(request),
+                        [
+                            (text_hash(request.texts[step[position][1]]), labels[position], confidences[position])
+                            for position in mine
+                            if labels[position] != UNRECOGNIZED_LABEL
+                        ],
+                    )
+            with self._condition:
+                for request in requests:
+                    if not request.pending:
+                        self._requests.remove(request)
+                        request.finish()
+
+# === Model Service ===
+class ModelService:
+    """The loaded model plus the per-session KV states and classification batcher shared by all clients."""
+
+    def __init__(self, llm, cache=None):
+        self.llm = llm
+        self.chat_states = ChatStateCache()
+        self.batcher = ClassifyBatcher(llm, cache)
+
+    @contextmanager
+    def hold(self, session_id=None):
+        """The model for one completion: with this session's KV state when given, else just locked."""
+        if session_id:
+            with self.chat_states.session(self.llm, session_id) as llm:
+                yield llm
+        else:
+            with model_lock(self.llm):
+                yield self.llm
+
+# === HTTP Handler ===
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP. Streaming responses are newline-delimited JSON, one object per
+    completion chunk (or classification update), ending when the connection closes.
+    """
+
+    def log_message(self, format, *args):
+        pass  # One line per request would swamp the console while streaming.
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json({"model": model_name(self.server.service.llm)})
+        else:
+            self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+
+    def do_POST(self):
+        routes = {
+            "/tokenize": self._tokenize,
+            "/v1/completions": self._completion,
+            "/v1/chat/completions": self._chat_completion,
+            "/classify": self._classify,
+        }
+        route = routes.get(self.path)
+        if route is None:
+            self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+            return
+        self._streaming = False
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            route(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client closed the connection; there is no one left to tell.
+        except Exception as e:
+            if self._streaming:
+                self._send_line({"error": str(e)})  # The status line has already gone out.
+            else:
+                self._send_json({"error": str(e)}, status=500)
+
+    # --- Routes ---
+    def _tokenize(self, payload):
+        tokens = self.server.service.llm.tokenize(
+            payload["text"].encode("utf-8"), add_bos=payload.get("add_bos", True), special=payload.get("special", False)
+        )
+        self._send_json({"tokens": list(tokens)})
+
+    def _completion(self, payload):
+        prompt = payload.pop("prompt")
+        self._run_completion(payload, lambda llm, **kwargs: llm.create_completion(prompt, **kwargs))
+
+    def _chat_completion(self, payload):
+        messages = payload.pop("messages")
+        self._run_completion(payload, lambda llm, **kwargs: llm.create_chat_completion(messages=messages, **kwargs))
+
+    def _run_completion(self, payload, complete):
+        session_id = payload.pop("session_id", None)
+        stream = payload.pop("stream", False)
+        with self.server.service.hold(session_id) as llm:
+            if not stream:
+                self._send_json(complete(llm, **payload))
+                return
+            # The model stays held until the last chunk is sent.
+            self._start_stream()
+            for chunk in complete(llm, stream=True, **payload):
+                self._send_line(chunk)
+
+    def _classify(self, payload):
+        options = {key: payload[key] for key in CLASSIFY_OPTIONS if key in payload}
+        batcher = self.server.service.batcher
+        request = batcher.submit(payload["texts"], options)
+        try:
+            self._start_stream()
+            while True:
+                event = request.events.get()
+                self._send_line(event)
+                if "stats" in event or "error" in event:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            # A cancelled job closes its stream; free the model for the other clients.
+            batcher.cancel(request)
+
+    # --- Responses ---
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self._streaming = True
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+    def _send_line(self, body):
+        self.wfile.write(json.dumps(body).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+# === CLI ===
+def build_parser():
+    parser = argparse.ArgumentParser(description="Serve one GGUF model to every app on this host.")
+    parser.add_argument("--model", default=MODEL_PATH, help="Path to the GGUF model")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--n-ctx", type=int, default=N_CTX, help="Context size")
+    parser.add_argument("--threads", type=int, default=N_THREADS, help="llama.cpp threads")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="SQLite sentiment cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the sentiment cache")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.exists(args.model):
+        sys.exit(f"Model not found at: {args.model}")
+
+    from llama_cpp import Llama
+
+    start = time.perf_counter()
+    llm = Llama(model_path=args.model, n_ctx=args.n_ctx, n_threads=args.threads, verbose=False)
+    print(f"Loaded {os.path.basename(args.model)} in {time.perf_counter() - start:.1f}s")
+
+    server = ThreadingHTTPServer((args.host, args.port), ModelRequestHandler)
+    server.daemon_threads = True
+    server.service = ModelService(llm, None if args.no_cache else SentimentCache(args.cache))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# === Configuration ===
+TOKEN_PATTERN = re.compile(r"\b\w+\b")
+# A simple stopword list to make keyword search more relevant
+STOP_WORDS = {"i", "me", "my", "is", "a", "an", "the", "and", "what", "are", "about", "show", "tell", "of", "in", "on"}
+MIN_KEYWORD_LENGTH = 3
+BM25_K1 = 1.2   # Term-frequency saturation
+BM25_B = 0.75   # Document-length normalization
+
+def tokenize(text):
+    """Lower-case word tokens of a text; non-strings (NaN, numbers) give no tokens."""
+    if not isinstance(text, str):
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+def query_keywords(query):
+    """The distinct words of a chat question worth searching for."""
+    words = dict.fromkeys(tokenize(query))
+    return [word for word in words if word not in STOP_WORDS and len(word) >= MIN_KEYWORD_LENGTH]
+
+# === Inverted Index ===
+class ReviewIndex:
+    """
+    Token -> row postings for a text column, plus row postings per sentiment label.
+    Built once per labelled DataFrame so each chat turn is a few dictionary lookups
+    and sorted-array merges instead of a scan over every row.
+    Postings are row positions (for df.iloc), sorted and unique, with the token's
+    count in each row and the row lengths kept alongside for BM25 ranking.
+    """
+
+    def __init__(self, texts, sentiments=None):
+        postings = defaultdict(list)
+        frequencies = defaultdict(list)
+        lengths = []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for token, count in Counter(tokens).items():
+                postings[token].append(position)
+                frequencies[token].append(count)
+        self.postings = {token: np.array(rows, dtype=np.int64) for token, rows in postings.items()}
+        self.frequencies = {token: np.array(counts, dtype=np.float32) for token, counts in frequencies.items()}
+        self.lengths = np.array(lengths, dtype=np.float32)
+        self.size = len(lengths)
+        self.average_length = float(self.lengths.mean()) if self.size else 0.0
+
+        self.sentiment_postings = {}
+        if sentiments is not None:
+            sentiments = np.asarray(sentiments, dtype=object)
+            for label in dict.fromkeys(sentiments):
+                self.sentiment_postings[label] = np.flatnonzero(sentiments == label)
+
+    def rows_with_sentiment(self, sentiment):
+        return self.sentiment_postings.get(sentiment, np.empty(0, dtype=np.int64))
+
+    def lookup(self, keywords, sentiment=None):
+        """
+        Positions of rows containing any of `keywords` (every row when there are none),
+        restricted to rows labelled `sentiment` when one is given.
+        """
+        if keywords:
+            matches = [self.postings[word] for word in keywords if word in self.postings]
+            rows = np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.int64)
+        else:
+            rows = np.arange(self.size, dtype=np.int64)
+        if sentiment is not None:
+            rows = np.intersect1d(rows, self.rows_with_sentiment(sentiment), assume_unique=True)
+        return rows
+
+    def search(self, keywords, k, sentiment=None):
+        """
+        The `k` best rows for `keywords` by BM25, best first, optionally restricted to
+        rows labelled `sentiment`. Only rows containing a keyword are scored, so the
+        cost depends on the matching postings rather than the size of the column.
+        """
+        keywords = [word for word in dict.fromkeys(keywords) if word in self.postings]
+        if not keywords or k <= 0:
+            return np.empty(0, dtype=np.int64)
+
+        positions, weights = [], []
+        for word in keywords:
+            rows, counts = self.postings[word], self.frequencies[word]
+            idf = np.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[rows] / (self.average_length or 1.0))
+            positions.append(rows)
+            weights.append(idf * counts * (BM25_K1 + 1) / (counts + norm))
+        positions = np.concatenate(positions)
+        weights = np.concatenate(weights)
+        if sentiment is not None:
+            keep = np.isin(positions, self.rows_with_sentiment(sentiment))
+            positions, weights = positions[keep], weights[keep]
+
+        rows, inverse = np.unique(positions, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights, minlength=len(rows))
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(rows))
+        # Highest score first; ties keep row order so the context is deterministic.
+        top = top[np.lexsort((rows[top], -scores[top]))]
+        return rows[top]
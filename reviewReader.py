@@ -0,0 +1,124 @@
+import os
+
+import pandas as pd
+
+# === Configuration ===
+DEFAULT_CHUNK_SIZE = 5000  # Rows held in memory at once while streaming a file
+STREAMING_FILE_TYPES = [".xlsx", ".csv", ".parquet"]
+
+def file_type(path_or_file, default=".xlsx"):
+    """Lower-case extension of a path or of an uploaded file's name."""
+    name = path_or_file if isinstance(path_or_file, (str, os.PathLike)) else getattr(path_or_file, "name", "")
+    return os.path.splitext(str(name))[1].lower() or default
+
+# === Chunked Readers ===
+def _iter_xlsx_chunks(source, chunk_size):
+    from openpyxl import load_workbook
+
+    # read_only mode parses the sheet XML lazily instead of building the whole workbook.
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f"Unnamed: {i}" if name is None else name for i, name in enumerate(header)]
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+def _iter_parquet_chunks(source, chunk_size):
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+def iter_row_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, kind=None):
+    """
+    Yields DataFrames of at most `chunk_size` rows from an .xlsx, .csv or .parquet
+    file (a path or a file-like object such as a Streamlit upload), so memory is
+    bounded by the chunk size rather than the file size. Row indexes continue
+    across chunks.
+    """
+    kind = kind or file_type(source)
+    if kind == ".csv":
+        chunks = pd.read_csv(source, chunksize=chunk_size)
+    elif kind == ".parquet":
+        chunks = _iter_parquet_chunks(source, chunk_size)
+    elif kind == ".xlsx":
+        chunks = _iter_xlsx_chunks(source, chunk_size)
+    elif kind == ".xls":
+        # Legacy .xls has no streaming reader; load it whole and hand it out in chunks.
+        df = pd.read_excel(source)
+        chunks = (df.iloc[offset:offset + chunk_size] for offset in range(0, len(df), chunk_size))
+    else:
+        raise ValueError(f"Unsupported file type '{kind}'. Use one of: {', '.join(STREAMING_FILE_TYPES + ['.xls'])}")
+
+    offset = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+# === Incremental Writer ===
+class ChunkWriter:
+    """
+    Appends labelled DataFrame chunks to an .xlsx, .csv or .parquet file as they
+    are produced. Use as a context manager; the file is complete once it closes.
+    """
+
+    def __init__(self, path, kind=None):
+        self.path = path
+        self.kind = kind or file_type(path)
+        if self.kind not in STREAMING_FILE_TYPES:
+            raise ValueError(f"Unsupported output file type '{self.kind}'. Use one of: {', '.join(STREAMING_FILE_TYPES)}")
+        self.rows_written = 0
+        self._writer = None
+        self._workbook = None
+
+    def write(self, chunk):
+        if self.kind == ".csv":
+            chunk.to_csv(self.path, mode="w" if self.rows_written == 0 else "a", header=self.rows_written == 0, index=False)
+        elif self.kind == ".parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            elif table.schema != self._writer.schema:
+                # e.g. a chunk whose column is all-null comes through as type null.
+                table = table.cast(self._writer.schema)
+            self._writer.write_table(table)
+        else:
+            if self._workbook is None:
+                from openpyxl import Workbook
+
+                # write_only workbooks stream rows to a temp file instead of keeping cells in memory.
+                self._workbook = Workbook(write_only=True)
+                self._sheet = self._workbook.create_sheet()
+                self._sheet.append([str(col) for col in chunk.columns])
+            for row in chunk.itertuples(index=False, name=None):
+                self._sheet.append([None if pd.isna(value) else value for value in row])
+        self.rows_written += len(chunk)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._workbook is not None:
+            self._workbook.save(self.path)
+            self._workbook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
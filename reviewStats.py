@@ -0,0 +1,159 @@
+import re
+
+from reviewIndex import STOP_WORDS, tokenize
+
+# === Configuration ===
+COUNT_PATTERN = re.compile(r"\bhow many\b|\b(?:number|count|total) of\b|\bcount\b")
+PERCENT_PATTERN = re.compile(r"%|\bpercent(?:age)?\b|\bproportion\b|\bshare\b|\bratio\b|\bfraction\b")
+BREAKDOWN_PATTERN = re.compile(
+    r"\bbreak ?down\b|\bdistribution\b|\bsplit\b|\bof each\b|\bper (?:sentiment|label)\b"
+    r"|\b(?:sentiment|label) (?:counts|totals)\b|\bsummary of (?:the )?(?:sentiments?|labels?)\b"
+)
+# Asking for reasons, examples or themes needs the reviews themselves, not a count.
+OPEN_ENDED_PATTERN = re.compile(
+    r"\bwhy\b|\bexplain\b|\breasons?\b|\bexamples?\b|\bthemes?\b|\bsummari[sz]e\b|\bdescribe\b"
+    r"|\bwhat (?:do|does|did)\b|\bsuggest|\brecommend|\bimprove"
+)
+# "or", negations and exceptions change which rows count in ways a plain keyword match
+# cannot express ("staff or price", "price but not staff", "no text", "N/A rows").
+UNSUPPORTED_PATTERN = re.compile(r"\b(?:or|nor|no|not|none|without|but|except)\b|n't\b|\bn/a\b")
+LABEL_PATTERN = re.compile(r"\b(positive|negative|neutral)s?\b")
+# "How many reviews mention delivery?": the words after these must all appear in a row.
+MENTION_PATTERN = re.compile(
+    r"\b(?:mention(?:s|ed|ing)?|contain(?:s|ed|ing)?|talk(?:s|ed|ing)? about|about|say(?:s|ing)?"
+    r"|with the words?|including|regarding)\b(.*)$"
+)
+MENTION_FILLER = {"were", "was", "are", "have", "has", "had", "there", "that", "them", "they", "been", "being"}
+# Words a count question can contain besides the labels and mentioned words; anything
+# else ("from March", "by store") is a filter this router cannot apply.
+QUESTION_WORDS = {
+    "how", "many", "much", "number", "count", "total", "percent", "percentage", "proportion", "share",
+    "ratio", "fraction", "breakdown", "break", "down", "distribution", "split", "each", "per",
+    "sentiment", "sentiments", "label", "labels", "labelled", "labeled", "classified", "summary",
+    "review", "reviews", "comment", "comments", "feedback", "row", "rows", "entry", "entries",
+    "response", "responses", "text", "texts", "data", "file", "dataset", "uploaded",
+    "there", "were", "was", "are", "have", "has", "had", "got", "overall", "all", "this", "the",
+    "our", "give", "show", "get", "did", "does", "which", "whats", "can", "you", "please", "out",
+    "compared", "versus", "than", "more", "fewer", "less", "vs", "with", "customer", "customers",
+    "employee", "employees", "people", "users", "do", "we", "us", "it", "s",
+}
+
+def _words(text):
+    # Every word, however short, so nothing that changes the question is silently dropped.
+    return [word for word in dict.fromkeys(tokenize(text)) if word not in STOP_WORDS]
+
+def _labels(text):
+    return list(dict.fromkeys(match.capitalize() for match in LABEL_PATTERN.findall(text)))
+
+def parse_data_question(question):
+    """
+    The aggregate a chat question asks for, or None when it needs the model.
+    Returns {"kind": "count" | "percentage" | "breakdown", "labels": [...], "keywords": [...],
+    "label_first": bool} where `labels` are the sentiments asked about, `keywords` words the
+    rows must mention and `label_first` whether the labels name the rows counted over
+    ("negative reviews that mention price") rather than a share of the mentioning rows.
+    """
+    text = question.lower()
+    if OPEN_ENDED_PATTERN.search(text) or UNSUPPORTED_PATTERN.search(text):
+        return None
+    if BREAKDOWN_PATTERN.search(text):
+        kind = "breakdown"
+    elif PERCENT_PATTERN.search(text):
+        kind = "percentage"
+    elif COUNT_PATTERN.search(text):
+        kind = "count"
+    else:
+        return None
+
+    labels = _labels(text)
+    mention = MENTION_PATTERN.search(text)
+    keywords = []
+    label_first = False
+    if mention:
+        keywords = [
+            word
+            for word in _words(mention.group(1))
+            if word not in MENTION_FILLER and not LABEL_PATTERN.fullmatch(word)
+        ]
+        text = text[: mention.start()]
+        if keywords and labels and kind != "breakdown":
+            # "negative reviews mention price" is scoped to the label's rows, "reviews
+            # mentioning price are negative" to the mentioning rows; labels on both sides
+            # of the mention leave the denominator unclear.
+            leading = _labels(text)
+            if leading and len(leading) != len(labels):
+                return None
+            label_first = bool(leading)
+    leftover = [
+        word for word in _words(text) if word not in QUESTION_WORDS and not LABEL_PATTERN.fullmatch(word)
+    ]
+    if leftover:
+        return None
+    return {"kind": kind, "labels": labels, "keywords": keywords, "label_first": label_first}
+
+def mention_mask(texts, keywords):
+    """Boolean Series: rows whose text contains every keyword as a whole word."""
+    mask = texts.notna()
+    for word in keywords:
+        mask &= texts.str.contains(rf"\b{re.escape(word)}\b", case=False, regex=True, na=False)
+    return mask
+
+def _share(count, total):
+    return f"{count / total:.1%}" if total else "0.0%"
+
+def answer_data_question(question, df, text_column, noun="reviews"):
+    """
+    Answers count, percentage and breakdown questions about the labelled DataFrame
+    with pandas aggregations, in milliseconds and exactly. Returns None for anything
+    else (open-ended questions, filters it cannot apply), which the model should answer.
+    """
+    intent = parse_data_question(question)
+    if intent is None or "Sentiment" not in df.columns:
+        return None
+
+    sentiments = df["Sentiment"]
+    total = len(df)
+    scope = f"{total:,} {noun}"
+    if intent["label_first"]:
+        mask = mention_mask(df[text_column], intent["keywords"])
+        quoted = ", ".join(f'"{word}"' for word in intent["keywords"])
+        lines = []
+        for label in intent["labels"]:
+            labelled = sentiments == label
+            size = int(labelled.sum())
+            count = int((labelled & mask).sum())
+            if intent["kind"] == "percentage":
+                lines.append(
+                    f"**{_share(count, size)}** of {size:,} {label} {noun} mention {quoted} ({count:,} of {size:,})."
+                )
+            else:
+                lines.append(f"**{count:,}** of {size:,} {label} {noun} mention {quoted} ({_share(count, size)}).")
+        return "\n\n".join(lines)
+
+    if intent["keywords"]:
+        mask = mention_mask(df[text_column], intent["keywords"])
+        sentiments = sentiments[mask]
+        quoted = ", ".join(f'"{word}"' for word in intent["keywords"])
+        if intent["kind"] != "breakdown" and not intent["labels"]:
+            matched = int(mask.sum())
+            if intent["kind"] == "percentage":
+                return f"**{_share(matched, total)}** of {noun} mention {quoted} ({matched:,} of {total:,})."
+            return f"**{matched:,}** of {total:,} {noun} mention {quoted} ({_share(matched, total)})."
+        scope = f"the {len(sentiments):,} {noun} mentioning {quoted}"
+
+    counts = sentiments.value_counts()
+    size = len(sentiments)
+    if intent["kind"] == "breakdown" or not intent["labels"]:
+        if intent["kind"] == "count" and not intent["labels"] and not intent["keywords"]:
+            return f"There are **{total:,}** {noun} in the data."
+        lines = [f"- **{label}**: {count:,} ({_share(count, size)})" for label, count in counts.items()]
+        return f"Sentiment of {scope}:\n" + "\n".join(lines or ["- (none)"])
+
+    lines = []
+    for label in intent["labels"]:
+        count = int(counts.get(label, 0))
+        if intent["kind"] == "percentage":
+            lines.append(f"**{_share(count, size)}** of {scope} are {label} ({count:,} of {size:,}).")
+        else:
+            lines.append(f"**{count:,}** of {scope} are {label} ({_share(count, size)}).")
+    return "\n\n".join(lines)
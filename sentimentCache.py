@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+# === Configuration ===
+DEFAULT_CACHE_PATH = "./sentiment_cache.sqlite3"
+SQLITE_MAX_PARAMS = 500  # Keep IN (...) lookups well under SQLite's variable limit
+
+# === Keys ===
+def normalize_text(text):
+    """Collapses whitespace and case so padded or re-cased copies share one key."""
+    return " ".join(str(text).split()).lower()
+
+def text_hash(text):
+    """SHA-256 of the normalized text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+def model_name(llm):
+    """File name of the loaded GGUF, used to keep labels from different models apart."""
+    return os.path.basename(getattr(llm, "model_path", "") or "unknown-model")
+
+def prompt_version(prompt, subject, mode):
+    """
+    Short fingerprint of everything that shapes a label besides the text itself.
+    Editing a prompt template changes the fingerprint, so stale labels are never served.
+    """
+    payload = json.dumps({"prompt": prompt, "subject": subject, "mode": mode}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+# === Persistent Cache ===
+class SentimentCache:
+    """
+    On-disk sentiment labels keyed by (text hash, model file, prompt version).
+    Each call opens its own SQLite connection, so one instance can be shared
+    across Streamlit sessions and threads.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS sentiment_cache (
+                    text_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    label TEXT NOT NULL,
+                    confidence REAL,
+                    PRIMARY KEY (text_hash, model, prompt_version)
+                ) WITHOUT ROWID"""
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(self, model, version, hashes):
+        """Returns {text_hash: (label, confidence)} for the hashes already cached."""
+        hashes = list(hashes)
+        found = {}
+        with self._connect() as conn:
+            for offset in range(0, len(hashes), SQLITE_MAX_PARAMS):
+                chunk = hashes[offset:offset + SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"""SELECT text_hash, label, confidence FROM sentiment_cache
+                        WHERE model = ? AND prompt_version = ? AND text_hash IN ({placeholders})""",
+                    [model, version, *chunk],
+                )
+                for hash_, label, confidence in rows:
+                    found[hash_] = (label, confidence)
+        return found
+
+    def put_many(self, model, version, entries):
+        """Stores an iterable of (text_hash, label, confidence) tuples."""
+        with self._connect() as conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO sentiment_cache
+                   (text_hash, model, prompt_version, label, confidence) VALUES (?, ?, ?, ?, ?)""",
+                [(hash_, model, version, label, confidence) for hash_, label, confidence in entries],
+            )
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+
+# === Configuration ===
+DEFAULT_CHECKPOINT_DIR = "./sentiment_checkpoints"
+DEFAULT_FLUSH_EVERY = 50  # Rows buffered between writes to the checkpoint file
+HASH_BLOCK_SIZE = 1 << 20
+
+def file_content_hash(source):
+    """SHA-256 of a file's bytes; `source` is a path or a seekable file-like object."""
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+    else:
+        position = source.tell()
+        source.seek(0)
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+        source.seek(position)
+    return digest.hexdigest()
+
+# === Job Checkpoint ===
+class SentimentCheckpoint:
+    """
+    Append-only JSON Lines record of the rows a labelling job has finished, so a
+    restarted job (crashed process, reloaded Streamlit tab) skips them. Each line is
+    {"row": <row id>, "label": ..., "confidence": ...}.
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer = []
+
+    @classmethod
+    def for_file(cls, source, text_column, directory=DEFAULT_CHECKPOINT_DIR, flush_every=DEFAULT_FLUSH_EVERY, **job_options):
+        """
+        Checkpoint for labelling `text_column` of `source`. The name combines the file's
+        content hash with the column and `job_options` (e.g. model, mode), so a changed
+        file or different settings start a fresh checkpoint.
+        """
+        options = json.dumps({"column": text_column, **job_options}, sort_keys=True, default=str)
+        job_hash = hashlib.sha256(options.encode("utf-8")).hexdigest()[:12]
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, f"{file_content_hash(source)[:32]}-{job_hash}.jsonl"), flush_every)
+
+    def load(self):
+        """Returns {row id: (label, confidence)} for every row already recorded."""
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash mid-write
+                completed[entry["row"]] = (entry["label"], entry["confidence"])
+        return completed
+
+    def record(self, entries):
+        """Buffers (row id, label, confidence) tuples, writing them out every `flush_every` rows."""
+        self._buffer.extend(entries)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            for row, label, confidence in self._buffer:
+                f.write(json.dumps({"row": row, "label": label, "confidence": confidence}) + "\n")
+        self._buffer = []
+
+    def finish(self):
+        """Removes the checkpoint once the job's output has been saved."""
+        self._buffer = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,564 @@
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from sentimentCache import model_name, normalize_text, prompt_version, text_hash
+
+# === Configuration ===
+SENTIMENT_LABELS = ["Positive", "Negative", "Neutral"]
+UNRECOGNIZED_LABEL = "Unrecognized"
+MISSING_LABEL = "N/A"
+DEFAULT_BATCH_SIZE = 8
+TOKENS_PER_BATCH_LABEL = 6  # Budget for one "12: Positive" line in a batched reply
+GRAMMAR_LABEL_TOKENS = 4  # A label and the end-of-sequence token under the label grammar
+REASON_SEPARATOR = " - "
+CLASSIFICATION_MODES = ["generate", "logits", "grammar"]
+POTENTIAL_TEXT_COLUMNS = ["Review", "Employee_Comment", "Comment", "Text", "Feedback"]
+
+def find_text_column(columns):
+    """Returns the first of POTENTIAL_TEXT_COLUMNS present in `columns`, or None."""
+    for col in POTENTIAL_TEXT_COLUMNS:
+        if col in columns:
+            return col
+    return None
+
+# === Prompt Templates ===
+# Every prompt is split into a fixed `prefix` (instructions, identical for every row) and a
+# per-row `suffix`. The prefix is evaluated once and its KV state reused for each row.
+LLAMA3_SENTIMENT_PROMPT = {
+    "prefix": """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+You are a sentiment analysis expert. Classify the following {subject_lower} as 'Positive', 'Negative', or 'Neutral'. Respond with only one of those three words.<|eot_id|>
+<|start_header_id|>user<|end_header_id|>
+""",
+    "suffix": """{subject}: "{text}"
+Sentiment:<|eot_id|>
+<|start_header_id|>assistant<|end_header_id|>
+""",
+    "max_tokens": 8,
+    "stop": ["\n", "<|eot_id|>"],
+}
+
+PLAIN_SENTIMENT_PROMPT = {
+    "prefix": """You are a sentiment classifier.
+Classify this {subject_lower} as Positive, Neutral, or Negative.
+""",
+    "suffix": """{subject}: "{text}"
+Sentiment (only one word):""",
+    "max_tokens": 10,
+    "stop": ["\n"],
+}
+
+# For mode="grammar" only: the label, then REASON_SEPARATOR and up to `reason_tokens` of explanation.
+LLAMA3_REASON_SENTIMENT_PROMPT = {
+    "prefix": """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+You are a sentiment analysis expert. Classify the following {subject_lower} as 'Positive', 'Negative', or 'Neutral'. Respond with one of those three words, then ' - ' and the reason in at most ten words.<|eot_id|>
+<|start_header_id|>user<|end_header_id|>
+""",
+    "suffix": LLAMA3_SENTIMENT_PROMPT["suffix"],
+    "max_tokens": 32,
+    "stop": ["\n", "<|eot_id|>"],
+    "reason_tokens": 24,
+}
+
+BATCH_SENTIMENT_PROMPT = {
+    "prefix": """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+You are a sentiment analysis expert. Classify each numbered {subject_lower} as 'Positive', 'Negative', or 'Neutral'. Respond with one line per item in the form '<number>: <label>', using only those three words as labels.<|eot_id|>
+<|start_header_id|>user<|end_header_id|>
+""",
+    "suffix": """{text}
+Sentiments:<|eot_id|>
+<|start_header_id|>assistant<|end_header_id|>
+""",
+    "stop": ["<|eot_id|>"],
+}
+
+def build_prompt_parts(prompt, text, subject="Text"):
+    """Returns the (prefix, suffix) strings of `prompt` filled in for one row."""
+    prefix = prompt["prefix"].format(subject=subject, subject_lower=subject.lower())
+    suffix = prompt["suffix"].format(subject=subject, subject_lower=subject.lower(), text=text)
+    return prefix, suffix
+
+def build_sentiment_prompt(text, subject="Text", prompt=LLAMA3_SENTIMENT_PROMPT):
+    """Builds the full single-item classification prompt as one string."""
+    return "".join(build_prompt_parts(prompt, text, subject))
+
+def format_batch_items(texts, subject="Text"):
+    """Numbers the batch items one per line, flattening embedded newlines."""
+    return "\n".join(
+        f'{i}. {subject}: "{" ".join(str(text).split())}"' for i, text in enumerate(texts, start=1)
+    )
+
+def build_batch_prompt(texts, subject="Text"):
+    """
+    Builds one prompt that asks for a label per numbered item, so the instructions
+    are evaluated once for the whole batch instead of once per row.
+    """
+    return build_sentiment_prompt(format_batch_items(texts, subject), subject, BATCH_SENTIMENT_PROMPT)
+
+# === Model Access ===
+_model_locks = {}
+
+def model_lock(llm):
+    """
+    Re-entrant lock serializing use of one Llama instance across threads, e.g. a
+    background labelling job and a chat reply sharing the cached model.
+    """
+    return _model_locks.setdefault(id(llm), threading.RLock())
+
+# === Prefix KV-State Reuse ===
+class PrefixCache:
+    """
+    Evaluates a fixed prompt prefix once and keeps its KV state, so each row only
+    evaluates its own tokens. Llama.generate already skips the longest common token
+    prefix with whatever is in the context; restoring the saved state first makes
+    that hold even after other calls (e.g. chat completions) have used the model.
+    """
+
+    def __init__(self, llm, prefix):
+        self.llm = llm
+        self.tokens = llm.tokenize(
+            prefix.encode("utf-8"),
+            add_bos=not prefix.startswith("<|begin_of_text|>"),
+            special=True,
+        )
+        llm.reset()
+        llm.eval(self.tokens)
+        self.state = llm.save_state()
+
+    def prompt_tokens(self, suffix):
+        """Returns prefix + suffix tokens with the prefix KV state loaded in the model."""
+        n_prefix = len(self.tokens)
+        if self.llm.n_tokens < n_prefix or list(self.llm.input_ids[:n_prefix]) != self.tokens:
+            self.llm.load_state(self.state)
+        return self.tokens + self.llm.tokenize(suffix.encode("utf-8"), add_bos=False, special=True)
+
+_prefix_caches = {}
+
+def get_prefix_cache(llm, prefix):
+    """Returns the PrefixCache for `prefix` on this model instance, creating it on first use."""
+    key = (id(llm), prefix)
+    if key not in _prefix_caches:
+        _prefix_caches[key] = PrefixCache(llm, prefix)
+    return _prefix_caches[key]
+
+def complete_with_prefix(llm, prompt, text, subject="Text", **kwargs):
+    """Runs a completion for one row, reusing the cached KV state of the prompt prefix."""
+    prefix, suffix = build_prompt_parts(prompt, text, subject)
+    with model_lock(llm):
+        tokens = get_prefix_cache(llm, prefix).prompt_tokens(suffix)
+        return llm(tokens, **kwargs)
+
+# === Logit Scoring ===
+def label_token_ids(llm, prompt):
+    """
+    Returns the first token id of each label as the model would emit it after `prompt`.
+    Prompts whose suffix does not end in whitespace are answered with a leading space.
+    """
+    lead = "" if prompt["suffix"][-1:].isspace() else " "
+    token_ids = [llm.tokenize(f"{lead}{label}".encode("utf-8"), add_bos=False)[0] for label in SENTIMENT_LABELS]
+    if len(set(token_ids)) != len(token_ids):
+        raise ValueError("Logits mode needs every sentiment label to start with a distinct token.")
+    return token_ids
+
+def _last_token_logits(llm):
+    import llama_cpp
+
+    return np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(llm.ctx, -1), shape=(llm.n_vocab(),))
+
+def score_sentiment(llm, text, subject="Text", prompt=LLAMA3_SENTIMENT_PROMPT):
+    """
+    Labels one row from a single forward pass: evaluates the row's tokens on top of the
+    cached prefix and takes the argmax over the label tokens' logits, with no decoding.
+    Returns (label, confidence), where confidence is the softmax over the label logits.
+    """
+    prefix, suffix = build_prompt_parts(prompt, text, subject)
+    with model_lock(llm):
+        prefix_cache = get_prefix_cache(llm, prefix)
+        tokens = prefix_cache.prompt_tokens(suffix)
+
+        # Drop whatever followed the prefix last time; eval() clears the KV cache past n_tokens.
+        llm.n_tokens = len(prefix_cache.tokens)
+        llm.eval(tokens[llm.n_tokens:])
+
+        label_logits = _last_token_logits(llm)[label_token_ids(llm, prompt)].astype(np.float64)
+    probabilities = np.exp(label_logits - label_logits.max())
+    probabilities /= probabilities.sum()
+    best = int(probabilities.argmax())
+    return SENTIMENT_LABELS[best], float(probabilities[best])
+
+# === Constrained Decoding ===
+def label_grammar(count=1, reason=False):
+    """
+    GBNF grammar under which the model can only write a valid label: one for a single
+    row (optionally followed by REASON_SEPARATOR and a one-line reason), or exactly
+    `count` numbered '<number>: <label>' lines for a batch. Once the grammar is complete
+    the only token left is end-of-sequence, so decoding stops right after the label.
+    """
+    rules = ['label ::= ' + " | ".join(f'"{label}"' for label in SENTIMENT_LABELS)]
+    if count == 1:
+        root = '" "? label'
+        if reason:
+            root += f' "{REASON_SEPARATOR}" reason'
+            rules.append(r'reason ::= [^\n]+')
+    else:
+        root = ' "\\n" '.join(f'"{number}: " label' for number in range(1, count + 1))
+    return "\n".join([f"root ::= {root}"] + rules)
+
+_grammars = {}
+
+def get_grammar(count=1, reason=False):
+    """Returns the compiled LlamaGrammar for label_grammar(count, reason), parsing it on first use."""
+    key = (count, reason)
+    if key not in _grammars:
+        from llama_cpp import LlamaGrammar
+
+        _grammars[key] = LlamaGrammar.from_string(label_grammar(count, reason), verbose=False)
+    return _grammars[key]
+
+# === Label Parsing ===
+def parse_sentiment_label(raw_output):
+    """Maps free-text model output onto one of the known sentiment labels."""
+    raw_sentiment = raw_output.strip().capitalize()
+    for label in SENTIMENT_LABELS:
+        if re.search(rf'\b{label}\b', raw_sentiment, re.IGNORECASE):
+            return label
+    return UNRECOGNIZED_LABEL
+
+def parse_batch_labels(raw_output, count):
+    """
+    Parses '<number>: <label>' lines from a batched reply.
+    Returns a list of length `count` with None for items the model skipped.
+    """
+    labels = [None] * count
+    for number, raw_label in re.findall(r'^\s*(\d+)\s*[:.)-]\s*(.+)$', raw_output, re.MULTILINE):
+        index = int(number) - 1
+        if 0 <= index < count and labels[index] is None:
+            labels[index] = parse_sentiment_label(raw_label)
+    return labels
+
+# === Classification ===
+def group_duplicates(texts, deduplicate=True):
+    """
+    Maps the index of the first row of each distinct (normalized) text to the indices of
+    all rows sharing it. Missing values are left out.
+    """
+    groups = {}
+    for i, text in enumerate(texts):
+        if not pd.isna(text):
+            key = normalize_text(text) if deduplicate else i
+            groups.setdefault(key, []).append(i)
+    return {rows[0]: rows for rows in groups.values()}
+
+def resume_from_checkpoint(checkpoint, pending, members, row_ids, assign):
+    """
+    Assigns checkpointed labels to the groups in `pending` that a previous run already
+    finished. Returns (still pending, rows resumed).
+    """
+    completed = checkpoint.load()
+    remaining, resumed = [], 0
+    for i in pending:
+        done_row = next((row_ids[row] for row in members[i] if row_ids[row] in completed), None)
+        if done_row is None:
+            remaining.append(i)
+        else:
+            assign(i, *completed[done_row])
+            resumed += len(members[i])
+    return remaining, resumed
+
+def label_distinct_texts(
+    texts,
+    label_pending,
+    mode="generate",
+    with_reasons=False,
+    deduplicate=True,
+    checkpoint=None,
+    progress_callback=None,
+    labels_callback=None,
+    lookup=None,
+):
+    """
+    The row bookkeeping behind classify_texts, shared with the worker pool and the model
+    server client: groups duplicate texts, resumes from the checkpoint, reports progress
+    and finished rows, records them in the checkpoint and builds the stats. Only the
+    labelling of the distinct texts still to do differs between them.
+
+    `label_pending(pending_texts, counts)` is a generator over those texts that yields
+    (positions, labels, confidences, reasons) as batches finish, positions indexing
+    `pending_texts` (confidences and reasons None where not produced), and adds to
+    counts["classified"] and counts["cache_hits"]. `lookup(pending_texts)` optionally
+    returns {position: (label, confidence)} for texts known without the model, which are
+    reported before the first batch along with the resumed rows.
+    """
+    row_ids = texts.index.tolist() if isinstance(texts, pd.Series) else list(range(len(texts)))
+    texts = list(texts)
+    total = len(texts)
+    labels = [MISSING_LABEL] * total
+    confidences = [None] * total
+    reasons = [None] * total
+
+    # --- Group rows by normalized text; the first row of each group is classified ---
+    members = group_duplicates(texts, deduplicate)
+    pending = list(members)
+    non_missing = sum(len(rows) for rows in members.values())
+
+    def assign(i, label, confidence):
+        for row in members[i]:
+            labels[row], confidences[row] = label, confidence
+
+    start = time.perf_counter()
+    resumed = 0
+    if checkpoint is not None:
+        pending, resumed = resume_from_checkpoint(checkpoint, pending, members, row_ids, assign)
+
+    counts = {"classified": 0, "cache_hits": 0}
+    if lookup is not None and pending:
+        known = lookup([texts[i] for i in pending])
+        for position, (label, confidence) in known.items():
+            assign(pending[position], label, confidence)
+            counts["cache_hits"] += len(members[pending[position]])
+        pending = [i for position, i in enumerate(pending) if position not in known]
+
+    done = total - sum(len(members[i]) for i in pending)
+    if progress_callback and done:
+        progress_callback(done, total)
+    if labels_callback and done:
+        waiting = {row for i in pending for row in members[i]}
+        known_rows = [row for row in range(total) if row not in waiting]
+        labels_callback(known_rows, [labels[row] for row in known_rows], [confidences[row] for row in known_rows])
+
+    batches = label_pending([texts[i] for i in pending], counts)
+    try:
+        for positions, batch_labels, batch_confidences, batch_reasons in batches:
+            indices = [pending[position] for position in positions]
+            for i, label, confidence, reason in zip(indices, batch_labels, batch_confidences, batch_reasons):
+                assign(i, label, confidence)
+                for row in members[i]:
+                    reasons[row] = reason
+            rows = [row for i in indices for row in members[i]]
+            if checkpoint is not None:
+                checkpoint.record([(row_ids[row], labels[row], confidences[row]) for row in rows])
+            if labels_callback:
+                labels_callback(rows, [labels[row] for row in rows], [confidences[row] for row in rows])
+
+            done += len(rows)
+            if progress_callback:
+                progress_callback(done, total)
+    finally:
+        batches.close()  # Stops the labelling (e.g. a server stream) when a callback raises.
+        # Also on errors/interruptions, so the next run resumes from here.
+        if checkpoint is not None:
+            checkpoint.flush()
+    elapsed = time.perf_counter() - start
+
+    stats = {
+        "rows": total,
+        "unique": len(members),
+        "dedup_ratio": 1 - len(members) / non_missing if non_missing else 0.0,
+        "classified": counts["classified"],
+        "resumed": resumed,
+        "cache_hits": counts["cache_hits"],
+        "seconds": elapsed,
+        "rows_per_sec": total / elapsed if elapsed > 0 else float("inf"),
+    }
+    if mode == "logits":
+        stats["confidences"] = confidences
+    if with_reasons:
+        stats["reasons"] = reasons
+    return labels, stats
+
+def _classify_single(llm, text, subject, prompt):
+    output = complete_with_prefix(
+        llm, prompt, text, subject, max_tokens=prompt["max_tokens"], stop=prompt["stop"]
+    )
+    return parse_sentiment_label(output["choices"][0]["text"])
+
+def _classify_constrained(llm, text, subject, prompt):
+    """Labels one row under the label grammar. Returns (label, reason or None)."""
+    reason_tokens = prompt.get("reason_tokens", 0)
+    output = complete_with_prefix(
+        llm,
+        prompt,
+        text,
+        subject,
+        max_tokens=GRAMMAR_LABEL_TOKENS + reason_tokens,
+        grammar=get_grammar(reason=bool(reason_tokens)),
+        temperature=0.0,
+    )
+    label, _, reason = output["choices"][0]["text"].strip().partition(REASON_SEPARATOR)
+    return label.strip(), reason.strip() or None
+
+def _classify_batch_constrained(llm, texts, subject, prompt):
+    try:
+        output = complete_with_prefix(
+            llm,
+            BATCH_SENTIMENT_PROMPT,
+            format_batch_items(texts, subject),
+            subject,
+            max_tokens=len(texts) * TOKENS_PER_BATCH_LABEL + 8,
+            grammar=get_grammar(len(texts)),
+            temperature=0.0,
+        )
+    except ValueError:
+        # The batch did not fit in the context window; classify row by row instead.
+        return [_classify_constrained(llm, text, subject, prompt)[0] for text in texts]
+    labels = parse_batch_labels(output["choices"][0]["text"], len(texts))
+    # The grammar only admits valid labels, but a reply cut off by max_tokens can still
+    # miss or truncate items; those get the single-item grammar prompt.
+    return [
+        label if label not in (None, UNRECOGNIZED_LABEL) else _classify_constrained(llm, text, subject, prompt)[0]
+        for label, text in zip(labels, texts)
+    ]
+
+def _classify_batch(llm, texts, subject, prompt):
+    try:
+        output = complete_with_prefix(
+            llm,
+            BATCH_SENTIMENT_PROMPT,
+            format_batch_items(texts, subject),
+            subject,
+            max_tokens=len(texts) * TOKENS_PER_BATCH_LABEL + 8,
+            stop=BATCH_SENTIMENT_PROMPT["stop"],
+            temperature=0.0,
+        )
+    except ValueError:
+        # The batch did not fit in the context window; classify row by row instead.
+        return [_classify_single(llm, text, subject, prompt) for text in texts]
+
+    labels = parse_batch_labels(output["choices"][0]["text"], len(texts))
+    # Anything the model skipped or garbled gets the single-item prompt, so batching
+    # never produces fewer recognised labels than the row-by-row loop.
+    return [
+        label if label not in (None, UNRECOGNIZED_LABEL) else _classify_single(llm, text, subject, prompt)
+        for label, text in zip(labels, texts)
+    ]
+
+def classify_texts(
+    llm,
+    texts,
+    subject="Text",
+    batch_size=DEFAULT_BATCH_SIZE,
+    progress_callback=None,
+    prompt=LLAMA3_SENTIMENT_PROMPT,
+    mode="generate",
+    cache=None,
+    deduplicate=True,
+    checkpoint=None,
+    labels_callback=None,
+):
+    """
+    Classifies every entry of `texts` (e.g. a DataFrame column) in batches of `batch_size`.
+    Missing values are labelled 'N/A' without calling the model. `prompt` is the
+    single-item template used when batch_size is 1 and for batch fallbacks.
+
+    mode="generate" decodes a short reply and parses the label out of it.
+    mode="logits" scores the label tokens from one forward pass per row (see
+    score_sentiment); it never yields 'Unrecognized' and ignores batch_size.
+    mode="grammar" decodes under a grammar that only admits the labels (see
+    label_grammar), so every row costs a fixed few tokens and only items of a batch
+    reply cut off by max_tokens are retried. With a prompt that has "reason_tokens"
+    (LLAMA3_REASON_SENTIMENT_PROMPT) rows are classified one at a time and
+    stats["reasons"] holds each row's short reason (None for rows from the cache or
+    checkpoint; not returned through the model server).
+
+    With `deduplicate`, texts that are equal after whitespace/case normalization are
+    classified once and the label is copied to every matching row.
+
+    With a `cache` (sentimentCache.SentimentCache) only texts not already cached for
+    this model and prompt are sent to the model; new labels are stored after every batch.
+
+    With a `checkpoint` (sentimentCheckpoint.SentimentCheckpoint) rows finished by an
+    earlier run are skipped and finished rows are recorded as the job goes. Rows are
+    identified by the Series index when `texts` is a Series, otherwise by position.
+
+    Returns (labels, stats) where stats holds the row count, unique texts, dedup ratio,
+    resumed rows, cache hits, elapsed seconds and rows/sec. In logits mode stats["confidences"] holds
+    the per-row confidence (None for 'N/A').
+    `progress_callback(done, total)` is called after every batch, and
+    `labels_callback(positions, labels, confidences)` with the rows each batch finished
+    (rows known up front, e.g. from the cache, are reported before the first batch).
+
+    `llm` may also be a modelClient.ModelClient, in which case the shared model server
+    does the classifying.
+    """
+    if mode not in CLASSIFICATION_MODES:
+        raise ValueError(f"Unknown classification mode '{mode}'. Use one of: {', '.join(CLASSIFICATION_MODES)}")
+    if getattr(llm, "is_remote", False):
+        return llm.classify(
+            texts,
+            subject=subject,
+            batch_size=batch_size,
+            progress_callback=progress_callback,
+            prompt=prompt,
+            mode=mode,
+            cache=cache,
+            deduplicate=deduplicate,
+            checkpoint=checkpoint,
+            labels_callback=labels_callback,
+        )
+
+    with_reasons = mode == "grammar" and bool(prompt.get("reason_tokens"))
+    batch_size = 1 if mode == "logits" or with_reasons else max(1, int(batch_size))
+    if cache is not None:
+        cache_model, cache_version = model_name(llm), prompt_version(prompt, subject, mode)
+
+    def lookup(pending_texts):
+        hashes = [text_hash(text) for text in pending_texts]
+        cached = cache.get_many(cache_model, cache_version, set(hashes))
+        return {position: cached[digest] for position, digest in enumerate(hashes) if digest in cached}
+
+    def label_pending(pending_texts, counts):
+        counts["classified"] = len(pending_texts)
+        for offset in range(0, len(pending_texts), batch_size):
+            batch = pending_texts[offset:offset + batch_size]
+            batch_confidences = [None] * len(batch)
+            batch_reasons = [None] * len(batch)
+            if mode == "logits":
+                label, batch_confidences[0] = score_sentiment(llm, batch[0], subject, prompt)
+                batch_labels = [label]
+            elif mode == "grammar" and len(batch) == 1:
+                label, batch_reasons[0] = _classify_constrained(llm, batch[0], subject, prompt)
+                batch_labels = [label]
+            elif mode == "grammar":
+                batch_labels = _classify_batch_constrained(llm, batch, subject, prompt)
+            elif len(batch) == 1:
+                batch_labels = [_classify_single(llm, batch[0], subject, prompt)]
+            else:
+                batch_labels = _classify_batch(llm, batch, subject, prompt)
+            if cache is not None:
+                # 'Unrecognized' is left uncached so those rows get another try next run.
+                cache.put_many(
+                    cache_model,
+                    cache_version,
+                    [
+                        (text_hash(text), label, confidence)
+                        for text, label, confidence in zip(batch, batch_labels, batch_confidences)
+                        if label != UNRECOGNIZED_LABEL
+                    ],
+                )
+            yield range(offset, offset + len(batch)), batch_labels, batch_confidences, batch_reasons
+
+    return label_distinct_texts(
+        texts,
+        label_pending,
+        mode=mode,
+        with_reasons=with_reasons,
+        deduplicate=deduplicate,
+        checkpoint=checkpoint,
+        progress_callback=progress_callback,
+        labels_callback=labels_callback,
+        lookup=lookup if cache is not None else None,
+    )
+
+def format_throughput(stats):
+    """Human-readable one-liner for the stats returned by classify_texts."""
+    summary = f"{stats['rows']} rows in {stats['seconds']:.1f}s ({stats['rows_per_sec']:.1f} rows/sec)"
+    if stats.get("dedup_ratio"):
+        summary += f", {stats['dedup_ratio']:.0%} duplicates skipped"
+    if stats.get("resumed"):
+        summary += f", {stats['resumed']} resumed from checkpoint"
+    if stats.get("cache_hits"):
+        summary += f", {stats['cache_hits']} from cache"
+    return summary
@@ -0,0 +1,169 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# === Configuration ===
+DEFAULT_MAX_CONCURRENT_JOBS = 2
+ACTIVE_STATUSES = ["queued", "running"]
+# Finished jobs nobody has looked at for this long are dropped with their DataFrame.
+DEFAULT_FINISHED_JOB_TTL_SECONDS = 3600
+
+class JobCancelled(Exception):
+    """Raised inside a job's progress callback to stop a cancelled classification."""
+
+# === Background Sentiment Job ===
+class SentimentJob:
+    """
+    One labelling run over a DataFrame column. Progress, partial labels and the final
+    stats are updated from the worker thread and read by the UI while it runs.
+    """
+
+    def __init__(self, name, df, text_column, key=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.name = name
+        self.df = df
+        self.text_column = text_column
+        self.status = "queued"
+        self.done = 0
+        self.total = len(df)
+        self.stats = None
+        self.error = None
+        self.last_seen = time.monotonic()
+        self._labels = [None] * len(df)
+        self._confidences = [None] * len(df)
+        self._lock = threading.Lock()
+        self._cancel_requested = threading.Event()
+        self._forgotten = False
+
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def is_active(self):
+        return self.status in ACTIVE_STATUSES
+
+    def record_labels(self, positions, labels, confidences):
+        """labels_callback for classify_texts: stores labels as batches finish."""
+        with self._lock:
+            for position, label, confidence in zip(positions, labels, confidences):
+                self._labels[position] = label
+                self._confidences[position] = confidence
+
+    def result_frame(self):
+        """
+        The rows labelled so far (all rows once the job is done) with a Sentiment column,
+        plus Confidence when the classifier produced one.
+        """
+        with self._lock:
+            labels = list(self._labels)
+            confidences = list(self._confidences)
+        mask = [label is not None for label in labels]
+        df = self.df[mask].copy()
+        df["Sentiment"] = [label for label in labels if label is not None]
+        if any(confidence is not None for confidence in confidences):
+            df["Confidence"] = [confidence for confidence, keep in zip(confidences, mask) if keep]
+        return df
+
+# === Job Manager ===
+class SentimentJobManager:
+    """
+    Runs labelling jobs on a thread pool so the Streamlit script never blocks on them.
+    Share one manager per server (st.cache_resource) so concurrent uploads from
+    different sessions queue on the same pool. Finished jobs are dropped once no
+    session has read them for `finished_job_ttl` seconds.
+    """
+
+    def __init__(
+        self, max_concurrent_jobs=DEFAULT_MAX_CONCURRENT_JOBS, finished_job_ttl=DEFAULT_FINISHED_JOB_TTL_SECONDS
+    ):
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix="sentiment-job")
+        self._finished_job_ttl = finished_job_ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, df, text_column, classify, key=None):
+        """
+        Queues `classify(texts, progress_callback, labels_callback) -> (labels, stats)`
+        over df[text_column] and returns the new SentimentJob. With a `key` (e.g. the
+        job's checkpoint path) an active job with the same key is returned instead, so
+        a re-upload after a tab reload follows the running job rather than racing it.
+        """
+        with self._lock:
+            self._drop_expired()
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and job.is_active and not job._cancel_requested.is_set():
+                        job.last_seen = time.monotonic()
+                        return job
+            job = SentimentJob(name, df, text_column, key)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, classify)
+        return job
+
+    def _run(self, job, classify):
+        def progress_callback(done, total):
+            if job._cancel_requested.is_set():
+                raise JobCancelled()
+            job.done = done
+
+        try:
+            if job._cancel_requested.is_set():
+                raise JobCancelled()
+            job.status = "running"
+            labels, stats = classify(job.df[job.text_column], progress_callback, job.record_labels)
+            job.record_labels(range(len(labels)), labels, stats.get("confidences", [None] * len(labels)))
+            job.stats = stats
+            job.done = job.total
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            # The TTL counts from when the job finished, not from its last poll.
+            job.last_seen = time.monotonic()
+            with self._lock:
+                if job._forgotten:
+                    self._jobs.pop(job.id, None)
+
+    def _drop_expired(self):
+        """Forgets finished jobs no session has read within the TTL; call with the lock held."""
+        cutoff = time.monotonic() - self._finished_job_ttl
+        for job_id, job in list(self._jobs.items()):
+            if not job.is_active and job.last_seen < cutoff:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        """The job, keeping it alive for another TTL; None once it was forgotten or expired."""
+        with self._lock:
+            self._drop_expired()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.last_seen = time.monotonic()
+            return job
+
+    def jobs(self):
+        with self._lock:
+            self._drop_expired()
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """Stops the job after its current batch; finished rows stay checkpointed."""
+        job = self.get(job_id)
+        if job is not None:
+            job._cancel_requested.set()
+
+    def forget(self, job_id):
+        """Drops a job (and its DataFrame) from the manager; an active one once it stops."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if job.is_active:
+                job._forgotten = True
+            else:
+                del self._jobs[job_id]
@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sentimentEngine import classify_texts, label_distinct_texts
+
+# === Configuration ===
+DEFAULT_THREADS_PER_WORKER = 8
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 1) // DEFAULT_THREADS_PER_WORKER)
+DEFAULT_N_CTX = 4096
+DEFAULT_SHARD_SIZE = 64  # Rows per task; small shards keep workers balanced and progress smooth
+
+# === Worker Process State ===
+# Each worker process loads its own Llama once, in the pool initializer. llama.cpp mmaps
+# the GGUF by default, so the weights are shared through the page cache; the per-worker
+# cost is mostly the KV cache (n_ctx) and compute buffers.
+_worker_llm = None
+
+def _init_worker(model_path, n_ctx, n_threads):
+    global _worker_llm
+    from llama_cpp import Llama
+
+    _worker_llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+
+def _classify_shard(texts, options):
+    return classify_texts(_worker_llm, texts, **options)
+
+# === Parallel Classification ===
+class SentimentWorkerPool:
+    """
+    A pool of `n_workers` model processes, each with `threads_per_worker` threads.
+    Keep one open across calls (e.g. while streaming a file in chunks) so the models
+    are loaded once; use as a context manager.
+    """
+
+    def __init__(
+        self,
+        model_path,
+        n_workers=DEFAULT_WORKERS,
+        threads_per_worker=DEFAULT_THREADS_PER_WORKER,
+        n_ctx=DEFAULT_N_CTX,
+    ):
+        self.n_workers = max(1, int(n_workers))
+        # "spawn" gives every worker a clean interpreter; llama.cpp state is not fork-safe.
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_path, n_ctx, threads_per_worker),
+        )
+
+    def classify(
+        self,
+        texts,
+        shard_size=DEFAULT_SHARD_SIZE,
+        progress_callback=None,
+        deduplicate=True,
+        checkpoint=None,
+        labels_callback=None,
+        **options,
+    ):
+        """
+        Same contract as sentimentEngine.classify_texts. Distinct texts are sharded across
+        the workers and the labels are merged back in the original row order. The
+        checkpoint and callbacks are handled here in the parent; remaining keyword arguments (subject,
+        batch_size, prompt, mode, cache) are passed through to classify_texts inside
+        each worker.
+        """
+        mode = options.get("mode", "generate")
+        with_reasons = mode == "grammar" and bool(options.get("prompt", {}).get("reason_tokens"))
+        shard_options = dict(options, deduplicate=False)
+
+        def label_shards(pending_texts, counts):
+            shards = [
+                range(offset, min(offset + shard_size, len(pending_texts)))
+                for offset in range(0, len(pending_texts), shard_size)
+            ]
+            futures = {
+                self._executor.submit(_classify_shard, [pending_texts[position] for position in shard], shard_options): shard
+                for shard in shards
+            }
+            try:
+                for future in as_completed(futures):
+                    shard = futures[future]
+                    shard_labels, shard_stats = future.result()
+                    counts["classified"] += shard_stats["classified"]
+                    counts["cache_hits"] += shard_stats["cache_hits"]  # Distinct texts, since workers see no duplicates
+                    yield (
+                        shard,
+                        shard_labels,
+                        shard_stats.get("confidences", [None] * len(shard)),
+                        shard_stats.get("reasons", [None] * len(shard)),
+                    )
+            finally:
+                # Shards not started yet are dropped when the job stops early.
+                for future in futures:
+                    future.cancel()
+
+        labels, stats = label_distinct_texts(
+            texts,
+            label_shards,
+            mode=mode,
+            with_reasons=with_reasons,
+            deduplicate=deduplicate,
+            checkpoint=checkpoint,
+            progress_callback=progress_callback,
+            labels_callback=labels_callback,
+        )
+        stats["workers"] = self.n_workers
+        return labels, stats
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def classify_texts_parallel(
+    texts,
+    model_path,
+    n_workers=DEFAULT_WORKERS,
+    threads_per_worker=DEFAULT_THREADS_PER_WORKER,
+    n_ctx=DEFAULT_N_CTX,
+    **options,
+):
+    """
+    One-shot SentimentWorkerPool: starts the pool, classifies `texts` with the same
+    contract as sentimentEngine.classify_texts, and shuts the pool down.
+    """
+    with SentimentWorkerPool(model_path, n_workers, threads_per_worker, n_ctx) as pool:
+        return pool.classify(texts, **options)
@@ -2,9 +2,13 @@ import streamlit as st
 import pandas as pd
 from llama_cpp import Llama
 import os
+from modelClient import ModelClient
+from reviewStats import answer_data_question
+from sentimentEngine import classify_texts, format_throughput
 
 # --- CONFIG ---
 MODEL_PATH = "./Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf"
+MODEL_SERVER_URL = None  # e.g. "http://127.0.0.1:8765" to use a shared modelServer.py instead of loading the model here
 N_CTX = 2048
 N_THREADS = 8
 MAX_TOKENS = 256
@@ -12,6 +16,15 @@ MAX_TOKENS = 256
 # --- Load the model (cache to avoid reloading) ---
 @st.cache_resource(show_spinner="Loading LLaMA model...")
 def load_llama_model():
+    if MODEL_SERVER_URL:
+        # The shared server already holds the model: nothing to load here.
+        client = ModelClient(MODEL_SERVER_URL)
+        try:
+            client.health()
+        except OSError as e:
+            st.error(f"Model server not reachable at {MODEL_SERVER_URL}: {e}")
+            st.stop()
+        return client
     if not os.path.exists(MODEL_PATH):
         raise FileNotFoundError(f"Model not found at: {MODEL_PATH}")
     return Llama(
@@ -21,13 +34,17 @@ def load_llama_model():
 llm = load_llama_model()
 
 # --- Helper functions ---
-def generate_sentiment_prompt(review):
-    return f"""You are a sentiment analysis assistant.
+# The instructions are a fixed prefix shared by every review, so only the review itself
+# is evaluated per row (see sentimentEngine.PrefixCache).
+SENTIMENT_PROMPT = {
+    "prefix": """You are a sentiment analysis assistant.
 Your task is to analyze the sentiment of customer reviews and respond with ONLY ONE WORD: Positive, Neutral, or Negative.
 If review sounds like a suggestion for improvement or If anything is unclear, respond with Neutral. 
 
-Review: "{review}"
-Sentiment:"""
+""",
+    "suffix": """{subject}: "{text}"
+Sentiment:""",
+}
 
 def ask_about_data_prompt(data_summary, user_question):
     return f"""You are an intelligent assistant. The user has uploaded a dataset of customer reviews.
@@ -38,10 +55,10 @@ Here is the summary of the reviews:
 User Question: {user_question}
 Answer:"""
 
-def analyze_sentiment(review):
-    prompt = generate_sentiment_prompt(review)
-    output = llm(prompt, max_tokens=MAX_TOKENS, stop=["\n"])
-    return output["choices"][0]["text"].strip()
+def analyze_sentiments(reviews):
+    # One forward pass per unique review, then argmax over the three label tokens.
+    # Duplicate reviews (ignoring whitespace and case) are only scored once.
+    return classify_texts(llm, reviews, subject="Review", prompt=SENTIMENT_PROMPT, mode="logits")
 
 def get_summary(df):
     summary = df['Sentiment'].value_counts().to_dict()
@@ -67,9 +84,8 @@ if uploaded_file:
 
         if st.button("Run Sentiment Analysis"):
             with st.spinner("Analyzing sentiment..."):
-                df["Sentiment"] = df["Review"].apply(
-                    lambda r: analyze_sentiment(str(r)) if pd.notna(r) else "N/A"
-                )
+                df["Sentiment"], stats = analyze_sentiments(df["Review"])
+                st.caption(f"Labelled {format_throughput(stats)}")
                 summary_text = get_summary(df)
                 st.write("### Sentiment Summary", summary_text)
                 st.write("### Annotated Data", df)
@@ -80,8 +96,13 @@ if uploaded_file:
 
         user_question = st.text_input("Enter your question:")
         if user_question and "Sentiment" in df.columns:
-            with st.spinner("Thinking..."):
-                summary = get_summary(df)
-                prompt = ask_about_data_prompt(summary, user_question)
-                response = llm(prompt, max_tokens=MAX_TOKENS, stop=["\n"])
-                st.write("🧠 Response:", response["choices"][0]["text"].strip())
+            # Counts, percentages and breakdowns come straight from the labels, without the model.
+            answer = answer_data_question(user_question, df, "Review")
+            if answer is not None:
+                st.write("📊 Response:", answer)
+            else:
+                with st.spinner("Thinking..."):
+                    summary = get_summary(df)
+                    prompt = ask_about_data_prompt(summary, user_question)
+                    response = llm(prompt, max_tokens=MAX_TOKENS, stop=["\n"])
+                    st.write("🧠 Response:", response["choices"][0]["text"].strip())
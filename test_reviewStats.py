@@ -0,0 +1,60 @@
+import pandas as pd
+
+from reviewStats import answer_data_question, parse_data_question
+
+def _reviews():
+    return pd.DataFrame(
+        {
+            "Review": [
+                "The price was far too high",
+                "Rude staff",
+                "Slow delivery",
+                "Broken on arrival",
+                "Great price for the quality",
+                "Fair price, happy overall",
+            ],
+            "Sentiment": ["Negative", "Negative", "Negative", "Negative", "Positive", "Positive"],
+        }
+    )
+
+def test_parse_label_before_mention_scopes_to_label():
+    intent = parse_data_question("What percentage of negative reviews mention price?")
+    assert intent == {"kind": "percentage", "labels": ["Negative"], "keywords": ["price"], "label_first": True}
+
+def test_parse_label_after_mention_scopes_to_mentions():
+    intent = parse_data_question("What percentage of reviews mentioning price are negative?")
+    assert intent == {"kind": "percentage", "labels": ["Negative"], "keywords": ["price"], "label_first": False}
+
+def test_parse_labels_on_both_sides_needs_the_model():
+    assert parse_data_question("What percentage of negative reviews mention price and are positive?") is None
+
+def test_percentage_of_label_rows_that_mention_keyword():
+    answer = answer_data_question("What percentage of negative reviews mention price?", _reviews(), "Review")
+    assert answer == '**25.0%** of 4 Negative reviews mention "price" (1 of 4).'
+
+def test_count_of_label_rows_that_mention_keyword():
+    answer = answer_data_question("How many negative reviews mention price?", _reviews(), "Review")
+    assert answer == '**1** of 4 Negative reviews mention "price" (25.0%).'
+
+def test_percentage_of_mentioning_rows_with_label():
+    answer = answer_data_question("What percentage of reviews mentioning price are negative?", _reviews(), "Review")
+    assert answer == '**33.3%** of the 3 reviews mentioning "price" are Negative (1 of 3).'
+
+def test_open_ended_question_is_left_to_the_model():
+    assert answer_data_question("Why are negative reviews about price?", _reviews(), "Review") is None
+
+def test_or_but_and_negations_are_left_to_the_model():
+    for question in [
+        "How many reviews mention staff or price?",
+        "How many reviews mention price but not staff?",
+        "How many reviews don't mention price?",
+        "How many reviews have no text?",
+        "How many N/A rows are there?",
+        "What percentage of reviews mention price without staff?",
+    ]:
+        assert parse_data_question(question) is None, question
+        assert answer_data_question(question, _reviews(), "Review") is None, question
+
+def test_short_mentioned_words_are_kept():
+    intent = parse_data_question("How many reviews mention tv?")
+    assert intent["keywords"] == ["tv"]